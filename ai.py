@@ -1,69 +1,126 @@
 import random
+import time
+from transposition import TranspositionTable, EXACT, LOWERBOUND, UPPERBOUND, DEFAULT_HASH_MB
+from evaluation import PIECE_SCORE, PIECE_POSITION_SCORES, PIECE_VALUES, scanBoard
+from book import OpeningBook
+from tablebase import Tablebase, DRAW
 
-PIECE_SCORE = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
-
-KNIGHT_SCORES = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.6, 0.6, 0.6, 0.5, 0.2],
-                 [0.2, 0.5, 0.6, 0.7, 0.7, 0.6, 0.5, 0.2],
-                 [0.2, 0.5, 0.6, 0.7, 0.7, 0.6, 0.5, 0.2],
-                 [0.2, 0.5, 0.6, 0.6, 0.6, 0.6, 0.5, 0.2],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-BISHOP_SCORES = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-ROOK_SCORES = [[0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2],
-               [0.5, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.5],
-               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-               [0.2, 0.2, 0.2, 0.5, 0.5, 0.2, 0.2, 0.2]]
-
-QUEEN_SCORES = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-PAWN_SCORES = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.2, 0.2, 0.3, 0.4, 0.4, 0.3, 0.2, 0.2],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.2, 0.1, 0.1, 0.2, 0.2, 0.1, 0.1, 0.2],
-               [0.2, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.2],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-PIECE_POSITION_SCORES = {
-    "wp": PAWN_SCORES,
-    "bp": PAWN_SCORES[::-1],
-    "wN": KNIGHT_SCORES,
-    "bN": KNIGHT_SCORES[::-1],
-    "wB": BISHOP_SCORES,
-    "bB": BISHOP_SCORES[::-1],
-    "wR": ROOK_SCORES,
-    "bR": ROOK_SCORES[::-1],
-    "wQ": QUEEN_SCORES,
-    "bQ": QUEEN_SCORES[::-1]
-}
-
-CHECKMATE = 1000
+CHECKMATE = 10000  # scores are in tenths of a pawn (evaluation.SCORE_SCALE)
 STALEMATE = 0
-DEPTH = 2
+TABLEBASE_WIN = CHECKMATE // 2  # a won tablebase position, minus the plies to mate counted from the root
+DEPTH = 2  # depth searched when no time limit is given
+MAX_DEPTH = 32  # iterative deepening limit under a time budget
+MATE_BOUND = TABLEBASE_WIN - MAX_DEPTH - 256  # scores beyond this are mates, from the search or the tablebase
+MOVES_TO_GO = 30  # assumed number of moves left when the budget comes from a clock
+TIME_CHECK_INTERVAL = 128  # nodes between two looks at the clock
+MOVE_ORDERING = True  # switchable so its effect on node counts can be measured (see bench.py)
+QUIESCENCE = True  # resolve captures at the horizon instead of scoring in the middle of an exchange
+QUIESCENCE_CHECKS = True  # in check during quiescence, search every evasion instead of standing pat
+DELTA_MARGIN = 20  # a capture that can't lift the score within this margin of alpha is skipped
+NULL_MOVE = True  # null move pruning: skip the search of a position where passing already beats beta
+NULL_MOVE_REDUCTION = 2  # the pass is searched this much shallower, on top of the ply it uses
+LATE_MOVE_REDUCTIONS = True  # search quiet moves late in the move order shallower, again in full if they fail high
+LMR_MIN_DEPTH = 3  # no reductions closer to the horizon than this
+LMR_FULL_MOVES = 3  # moves searched to full depth before reductions start, twice as many before reducing by 2
+PRINCIPAL_VARIATION_SEARCH = True  # moves after the first are only shown to be worse, with a zero window
+ASPIRATION_WINDOWS = True  # search each depth in a window around the score of the previous one
+ASPIRATION_WINDOW = 5  # half width of the first window, it grows fourfold on every failure
+# piece values for ordering captures, the king is the least welcome attacker
+MVV_LVA_VALUE = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 10, "K": 20}
+DEBUG_EVAL = False  # cross-check the incremental score of GameState against a full board scan
+SEARCH_TIMING = False  # measure time spent in move generation and evaluation, costs two clock reads per call
 nextMove = None
+nodeCount = 0
+quiescenceNodeCount = 0
+searchDeadline = None
+searchStopEvent = None
+searchStats = None  # SearchStats of the running (or last) search
+openingBook = None  # OpeningBook played from before searching, see setOpeningBook
+tablebase = None  # Tablebase probed at the root and inside the search, see setTablebase
+transpositionTable = TranspositionTable(DEFAULT_HASH_MB)
+# triangular PV table: principalVariation[ply] is the best line found from the node at that ply
+principalVariation = [[] for _ in range(MAX_DEPTH + 1)]
+killerMoves = [[None, None] for _ in range(MAX_DEPTH + 1)]  # moveIDs of two quiet moves per ply that caused cutoffs
+historyTable = [0] * 4096  # butterfly (from, to) table indexed by moveID, how often a quiet move caused a cutoff
+
+
+class SearchStats:
+    """
+    What one findBestMove call did, returned and put on the returnQueue together with the move.
+    Moves are kept in coordinate notation and scores are from the side to move, in tenths of a pawn
+    """
+    def __init__(self):
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.betaCutoffs = 0  # in the main search, quiescence isn't counted
+        self.firstMoveCutoffs = 0  # cutoffs by the first move searched, a measure of move ordering
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.moveGenerationTime = 0.0  # both times are only measured with SEARCH_TIMING
+        self.evaluationTime = 0.0
+        self.elapsed = 0.0
+        self.bookMove = False  # the move came from the opening book, nothing was searched
+        self.tablebaseMove = False  # the move came from the tablebase, nothing was searched
+        self.tablebaseHits = 0  # positions inside the search answered by the tablebase
+        self.nullMoveCutoffs = 0
+        self.reducedSearches = 0  # late moves searched shallower
+        self.reSearches = 0  # reduced or zero window searches that failed high and were searched again
+        self.aspirationFailures = 0  # root searches that fell outside their window and were repeated
+        self.iterations = []  # one dictionary per completed depth: depth, score, pv, nodes, time
+
+    def getFirstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    def asDict(self):
+        stats = dict(self.__dict__)
+        stats["firstMoveCutoffRate"] = self.getFirstMoveCutoffRate()
+        return stats
+
+    def __str__(self):
+        if self.bookMove:
+            return "book move"
+        if self.tablebaseMove:
+            return "tablebase move"
+        last = self.iterations[-1] if self.iterations else {"depth": 0, "score": 0, "pv": []}
+        return "depth %d score %d nodes %d (%d quiescence) %.2fs cutoffs %d (%.0f%% first move) " \
+               "tt hits %d/%d pv %s" % (last["depth"], last["score"], self.nodes, self.quiescenceNodes,
+                                        self.elapsed, self.betaCutoffs, 100 * self.getFirstMoveCutoffRate(),
+                                        self.ttHits, self.ttProbes, " ".join(last["pv"]))
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the deadline has passed or a stop was requested,
+    every frame undoes its own move on the way out
+    """
+    pass
+
+
+def setHashSize(sizeMB):
+    """
+    Change the memory budget of the transposition table, this clears it
+    """
+    transpositionTable.resize(sizeMB)
+
+
+def setOpeningBook(path):
+    """
+    Play book moves while the game is in the book file at path (see book.py), None turns the book off
+    """
+    global openingBook
+    if openingBook is not None:
+        openingBook.close()
+    openingBook = OpeningBook(path) if path is not None else None
+
+
+def setTablebase(directory):
+    """
+    Use the endgame tables found in directory (see tablebase.py), None turns the tablebase off
+    """
+    global tablebase
+    if tablebase is not None:
+        tablebase.close()
+    tablebase = Tablebase(directory) if directory is not None else None
 
 
 def findRandomMove(validMoves):
@@ -73,41 +130,395 @@ def findRandomMove(validMoves):
     return random.choice(validMoves)
 
 
-def findBestMove(gs, validMoves, returnQueue):
+def orderMoves(moves, ttMoveID, ply):
     """
-    Find nega max move helper. First recursive caller
+    Sort moves so that the ones most likely to cause a cutoff are searched first:
+    1. the hash move (best move found for this position before)
+    2. captures and promotions, most valuable victim first, then least valuable attacker
+    3. the killer moves of this ply
+    4. other quiet moves by their history score
+    The sort is stable, so moves with equal keys keep the order they came in
     """
-    global nextMove
-    nextMove = None
-    random.shuffle(validMoves)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -
-                             CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    returnQueue.put(nextMove)
+    killers = killerMoves[ply]
+
+    def orderKey(move):
+        if move.moveID == ttMoveID:
+            return 1000000
+        if move.isCapture or move.isPawnPromotion:
+            victim = MVV_LVA_VALUE["Q"] if move.isPawnPromotion else MVV_LVA_VALUE[move.pieceCaptured[1]]
+            return 500000 + 100 * victim - MVV_LVA_VALUE[move.pieceMoved[1]]
+        if move.moveID == killers[0]:
+            return 400001
+        if move.moveID == killers[1]:
+            return 400000
+        return min(historyTable[move.moveID], 399999)
+
+    return sorted(moves, key=orderKey, reverse=True)
 
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
+def storeCutoff(move, depth, ply):
     """
-    White searches the highest value, black the lowest
+    Remember a quiet move that refuted the position, as killer for this ply and in the history table
+    """
+    if move.isCapture or move.isPawnPromotion:
+        return
+    killers = killerMoves[ply]
+    if killers[0] != move.moveID:
+        killers[1] = killers[0]
+        killers[0] = move.moveID
+    historyTable[move.moveID] += depth * depth
+
+
+def resetHeuristics():
+    """
+    Killers only apply to the search they were found in, history is kept but aged
+    """
+    for killers in killerMoves:
+        killers[0] = killers[1] = None
+    for i in range(len(historyTable)):
+        historyTable[i] >>= 3
+
+
+def allocateTime(moveTime=None, clockTime=None, increment=0.0, movesToGo=None):
+    """
+    Seconds to spend on this move: moveTime if given, otherwise an even share of the remaining clock
+    over movesToGo (MOVES_TO_GO if not known) plus most of the increment. None means no time limit
+    """
+    if moveTime is not None:
+        return moveTime
+    if clockTime is None:
+        return None
+    budget = clockTime / (movesToGo or MOVES_TO_GO) + increment * 0.8
+    # never plan to use more than half of what is left on the clock
+    return min(budget, clockTime / 2)
+
+
+def findBestMove(gs, validMoves, returnQueue, moveTime=None, clockTime=None, increment=0.0, maxDepth=None,
+                 stopEvent=None, startDepth=1, profiler=None, movesToGo=None, reportIteration=None):
+    """
+    Find nega max move helper. First recursive caller.
+    A position in the opening book is answered with a weighted random book move without searching,
+    one in the tablebase with the move that mates fastest (or loses slowest).
+    Otherwise it searches depth startDepth, startDepth + 1, ... (iterative deepening) until maxDepth is done,
+    the time budget is used or stopEvent (anything with is_set(), e.g. a multiprocessing.Event) is set.
+    Returns (move, SearchStats) for the last completed iteration and puts the same on the returnQueue,
+    if one is given. Without a time limit it searches to DEPTH.
+    The time budget lets the first iteration complete, stopEvent doesn't: stopped in the first iteration
+    it returns the best root move searched so far, or the first valid move if there is none yet.
+    A profiler (anything with enable() and disable(), e.g. cProfile.Profile) is run around this search only.
+    reportIteration is called with the dictionary of every completed iteration, as soon as it is done
+    """
+    global nextMove, nodeCount, quiescenceNodeCount, searchDeadline, searchStopEvent, searchStats
+    budget = allocateTime(moveTime, clockTime, increment, movesToGo)
+    if maxDepth is None:
+        maxDepth = DEPTH if budget is None else MAX_DEPTH
+    startTime = time.perf_counter()
+    nodeCount = 0
+    quiescenceNodeCount = 0
+    stats = searchStats = SearchStats()
+    ttProbes, ttHits = transpositionTable.probes, transpositionTable.hits
+    if SEARCH_TIMING:
+        startTiming(gs, stats)
+    if profiler is not None:
+        profiler.enable()
+    transpositionTable.newSearch()
+    resetHeuristics()
+    turnMultiplier = 1 if gs.whiteToMove else -1
+
+    # the only randomness: the choice between book moves
+    bestMove = openingBook.chooseMove(gs, validMoves) if openingBook is not None else None
+    stats.bookMove = bestMove is not None
+    if bestMove is None and tablebase is not None:
+        bestMove = tablebase.getBestMove(gs, validMoves)[0]
+        stats.tablebaseMove = bestMove is not None
+    if bestMove is not None:
+        maxDepth = startDepth - 1  # nothing to search
+    score = None
+    for depth in range(startDepth, maxDepth + 1):
+        # the first iteration outlasts the time budget, so there is a move to return, but not a stop
+        searchDeadline = startTime + budget if budget is not None and depth > startDepth else None
+        searchStopEvent = stopEvent
+        try:
+            score = searchRoot(gs, validMoves, depth, score, turnMultiplier)
+        except SearchTimeout:
+            if bestMove is None:
+                bestMove = nextMove if nextMove is not None else validMoves[0]
+            break
+        if nextMove is not None:
+            bestMove = nextMove
+        pv = [move.getChessNotation() for move in principalVariation[0]]
+        if not pv and bestMove is not None:
+            pv = [bestMove.getChessNotation()]
+        stats.iterations.append({"depth": depth, "score": score, "pv": pv,
+                                 "nodes": nodeCount, "time": time.perf_counter() - startTime})
+        if reportIteration is not None:
+            reportIteration(stats.iterations[-1])
+        if abs(score) >= CHECKMATE:
+            break  # forced mate either way, deeper search won't change the move
+        # the next iteration takes several times longer than this one, don't start what can't finish
+        if budget is not None and time.perf_counter() - startTime > budget / 2:
+            break
+
+    if profiler is not None:
+        profiler.disable()
+    if SEARCH_TIMING:
+        stopTiming(gs)
+    searchDeadline = None
+    searchStopEvent = None
+    stats.nodes = nodeCount
+    stats.quiescenceNodes = quiescenceNodeCount
+    stats.ttProbes = transpositionTable.probes - ttProbes
+    stats.ttHits = transpositionTable.hits - ttHits
+    stats.elapsed = time.perf_counter() - startTime
+    if returnQueue is not None:
+        returnQueue.put((bestMove, stats))
+    return bestMove, stats
+
+
+def searchRoot(gs, validMoves, depth, previousScore, turnMultiplier):
+    """
+    One iteration. With ASPIRATION_WINDOWS and the score of the previous depth, the search starts in a narrow
+    window around that score, most moves are then refuted sooner. A score outside the window is only a bound,
+    so the window is widened on that side and the depth searched again until the score falls inside
     """
     global nextMove
+    window = ASPIRATION_WINDOW
+    alpha, beta = -CHECKMATE, CHECKMATE
+    if ASPIRATION_WINDOWS and previousScore is not None and abs(previousScore) < MATE_BOUND:
+        alpha, beta = previousScore - window, previousScore + window
+    while True:
+        nextMove = None
+        score = findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
+        if score <= alpha and alpha > -CHECKMATE:
+            window *= 4
+            alpha = max(previousScore - window, -CHECKMATE) if window < MATE_BOUND else -CHECKMATE
+        elif score >= beta and beta < CHECKMATE:
+            window *= 4
+            beta = min(previousScore + window, CHECKMATE) if window < MATE_BOUND else CHECKMATE
+        else:
+            return score
+        searchStats.aspirationFailures += 1
+
+
+def startTiming(gs, stats):
+    """
+    For SEARCH_TIMING: route move generation of this GameState and the evaluation through timers.
+    The wrappers are instance and module attributes, so with the switch off nothing is in the way
+    """
+    global scoreMaterial
+    running = set()  # fields being timed, a call made inside another timed call isn't counted again
+
+    def timed(function, field):
+        def wrapper(*args, **kwargs):
+            if field in running:
+                return function(*args, **kwargs)  # e.g. inCheck called by getValidMoves
+            running.add(field)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                running.discard(field)
+                setattr(stats, field, getattr(stats, field) + time.perf_counter() - start)
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    for name in ("getValidMoves", "getCaptureMoves", "inCheck"):
+        setattr(gs, name, timed(getattr(gs, name), "moveGenerationTime"))
+    scoreMaterial = timed(scoreMaterial, "evaluationTime")
+
+
+def stopTiming(gs):
+    global scoreMaterial
+    for name in ("getValidMoves", "getCaptureMoves", "inCheck"):
+        delattr(gs, name)
+    scoreMaterial = scoreMaterial.__wrapped__
+
+
+def searchInterrupted():
+    """
+    Looked at every TIME_CHECK_INTERVAL nodes: the deadline has passed or a stop was requested
+    """
+    if searchDeadline is not None and time.perf_counter() > searchDeadline:
+        return True
+    return searchStopEvent is not None and searchStopEvent.is_set()
+
+
+def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0, allowNullMove=True):
+    """
+    White searches the highest value, black the lowest.
+    Positions already searched at least this deep are answered from the transposition table.
+    With NULL_MOVE and LATE_MOVE_REDUCTIONS the search is selective, see nullMovePrunes and the move loop.
+    The best line from this node is left in principalVariation[ply]
+    """
+    global nextMove, nodeCount
+    nodeCount += 1
+    if nodeCount % TIME_CHECK_INTERVAL == 0 and searchInterrupted():
+        raise SearchTimeout()
+    principalVariation[ply] = []
+
+    if len(validMoves) == 0:
+        return turnMultiplier * scoreBoard(gs)
+    if tablebase is not None and ply > 0:
+        value = tablebase.probe(gs)
+        if value is not None:
+            searchStats.tablebaseHits += 1
+            return scoreTablebase(value, ply)
     if depth == 0:
+        if QUIESCENCE:
+            return quiescence(gs, alpha, beta, turnMultiplier, ply)
         return turnMultiplier * scoreBoard(gs)
 
+    alphaOriginal = alpha
+    ttMoveID = None
+    entry = transpositionTable.probe(gs.zobristKey)
+    if entry is not None:
+        ttMoveID = entry[3]
+        # the root always searches, it has to set nextMove. Under PRINCIPAL_VARIATION_SEARCH only zero window
+        # nodes take cutoffs, so the few nodes on the principal variation search on and report their line
+        if ply > 0 and entry[0] >= depth and (beta - alpha == 1 or not PRINCIPAL_VARIATION_SEARCH):
+            score, flag = scoreFromTable(entry[1], ply), entry[2]
+            if flag == EXACT or (flag == LOWERBOUND and score >= beta) or (flag == UPPERBOUND and score <= alpha):
+                transpositionTable.cutoffs += 1
+                return score
+
+    inCheck = (NULL_MOVE or LATE_MOVE_REDUCTIONS) and gs.inCheck()
+    if NULL_MOVE and allowNullMove and ply > 0 and not inCheck and \
+            nullMovePrunes(gs, depth, beta, turnMultiplier, ply):
+        searchStats.nullMoveCutoffs += 1
+        return beta
+
+    if MOVE_ORDERING:
+        validMoves = orderMoves(validMoves, ttMoveID, ply)
+
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMove = None
+    killers = killerMoves[ply]
+    for index, move in enumerate(validMoves):
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = - \
-            findMoveNegaMaxAlphaBeta(
-                gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
+        try:
+            nextMoves = gs.getValidMoves()
+            reduction = 0
+            if LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and index >= LMR_FULL_MOVES and not inCheck \
+                    and not (move.isCapture or move.isPawnPromotion) and move.moveID not in killers \
+                    and not gs.inCheck():
+                # later in the order means less likely to matter, a move with a history of cutoffs less so
+                reduction = 2 if index >= 2 * LMR_FULL_MOVES and historyTable[move.moveID] == 0 else 1
+                reduction = min(reduction, depth - 2)
+            score = None
+            if reduction:
+                searchStats.reducedSearches += 1
+                # only asks whether the move beats alpha, a move that does is searched again in full
+                score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1 - reduction, -alpha - 1, -alpha,
+                                                  -turnMultiplier, ply + 1)
+                if score > alpha:
+                    searchStats.reSearches += 1
+                    score = None
+            if score is None and PRINCIPAL_VARIATION_SEARCH and index > 0 and beta - alpha > 1:
+                # after the first move the rest are expected to be worse, proving that takes a zero window.
+                # One that turns out better inside the window is searched again for its exact score
+                score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -alpha - 1, -alpha, -turnMultiplier,
+                                                  ply + 1)
+                if alpha < score < beta:
+                    searchStats.reSearches += 1
+                    score = None
+            if score is None:
+                score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier, ply + 1)
+        finally:
+            gs.undoMove()
 
-        if score > maxScore:
+        # at the root the first move is taken even if every move gets mated, so there is always one to play
+        if score > maxScore or (ply == 0 and nextMove is None):
             maxScore = score
-            if depth == DEPTH:
+            bestMove = move
+            if ply == 0:
                 nextMove = move
-        gs.undoMove()
 
         # pruning
+        if maxScore > alpha:
+            alpha = maxScore
+            principalVariation[ply] = [move] + principalVariation[ply + 1]
+        if alpha >= beta:
+            searchStats.betaCutoffs += 1
+            if index == 0:
+                searchStats.firstMoveCutoffs += 1
+            if MOVE_ORDERING:
+                storeCutoff(move, depth, ply)
+            break
+
+    if maxScore <= alphaOriginal:
+        flag = UPPERBOUND
+    elif maxScore >= beta:
+        flag = LOWERBOUND
+    else:
+        flag = EXACT
+    transpositionTable.store(gs.zobristKey, depth, scoreToTable(maxScore, ply), flag,
+                             bestMove.moveID if bestMove is not None else None)
+    return maxScore
+
+
+def nullMovePrunes(gs, depth, beta, turnMultiplier, ply):
+    """
+    Let the side to move pass and search the opponent's reply shallower with a zero window at beta.
+    If the score still reaches beta, a real move (almost always better than passing) would too and the
+    node fails high without being searched. Not tried when passing could be the best move: in pawn and king
+    endings (zugzwang), when the static score is already below beta or close to the horizon. The pass is
+    never followed by another one, and mate scores at beta aren't trusted to it
+    """
+    if depth <= NULL_MOVE_REDUCTION or abs(beta) >= MATE_BOUND:
+        return False
+    if not gs.hasPieces("w" if gs.whiteToMove else "b") or turnMultiplier * scoreMaterial(gs) < beta:
+        return False
+    gs.makeNullMove()
+    try:
+        nextMoves = gs.getValidMoves()
+        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1,
+                                          -turnMultiplier, ply + 1, allowNullMove=False)
+    finally:
+        gs.undoNullMove()
+    return score >= beta
+
+
+def quiescence(gs, alpha, beta, turnMultiplier, ply):
+    """
+    Search only captures below the horizon until the position is quiet.
+    The side to move can always decline to capture (stand pat) and keep the static score,
+    except when in check, where every evasion is searched if QUIESCENCE_CHECKS is on.
+    Captures that can't bring the score near alpha even by winning the piece are skipped (delta pruning)
+    """
+    global nodeCount, quiescenceNodeCount
+    nodeCount += 1
+    quiescenceNodeCount += 1
+    if nodeCount % TIME_CHECK_INTERVAL == 0 and searchInterrupted():
+        raise SearchTimeout()
+
+    if QUIESCENCE_CHECKS and gs.inCheck():
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            return -CHECKMATE
+        standPat = None
+        maxScore = -CHECKMATE
+    else:
+        standPat = turnMultiplier * scoreMaterial(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        moves = gs.getCaptureMoves()
+        maxScore = standPat
+
+    for move in sorted(moves, key=captureOrderKey, reverse=True):
+        if standPat is not None:
+            gain = PIECE_VALUES["Q"] - PIECE_VALUES["p"] if move.isPawnPromotion else 0
+            if standPat + PIECE_VALUES[move.pieceCaptured[1]] + gain + DELTA_MARGIN <= alpha:
+                continue
+        gs.makeMove(move)
+        try:
+            score = -quiescence(gs, -beta, -alpha, -turnMultiplier, ply + 1)
+        finally:
+            gs.undoMove()
+
+        if score > maxScore:
+            maxScore = score
         if maxScore > alpha:
             alpha = maxScore
         if alpha >= beta:
@@ -116,6 +527,15 @@ def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
     return maxScore
 
 
+def captureOrderKey(move):
+    """
+    Most valuable victim first, then least valuable attacker, quiet moves (evasions) last
+    """
+    if not move.isCapture:
+        return 0
+    return 100 * MVV_LVA_VALUE[move.pieceCaptured[1]] - MVV_LVA_VALUE[move.pieceMoved[1]]
+
+
 def scoreBoard(gs):
     """
     A positive score is good for white, a negative score is good for black
@@ -128,20 +548,48 @@ def scoreBoard(gs):
     elif gs.stalemate:
         return STALEMATE
 
-    score = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            piece = gs.board[row][col]
-            if piece != "--":
-                # score it by position
-                piecePositionScore = 0
-                if piece[1] != "K":
-                    piecePositionScore = PIECE_POSITION_SCORES[piece][row][col]
-
-                # score it by material
-                if piece[0] == 'w':
-                    score += PIECE_SCORE[piece[1]] + piecePositionScore
-                elif piece[0] == 'b':
-                    score -= PIECE_SCORE[piece[1]] + piecePositionScore
+    return scoreMaterial(gs)
+
+
+def scoreTablebase(value, ply):
+    """
+    Score for the side to move of a tablebase value, a quicker mate scores higher
+    """
+    if value == DRAW:
+        return STALEMATE
+    if value % 2 == 1:
+        return TABLEBASE_WIN - ply - value
+    return -(TABLEBASE_WIN - ply - value)
+
+
+def scoreToTable(score, ply):
+    """
+    Transposition table form of a search score. Tablebase scores count the plies to mate from the root,
+    the table keeps them counted from the position, so they hold wherever the position comes up again.
+    Checkmate scores carry no distance and are kept as they are
+    """
+    if MATE_BOUND < abs(score) < CHECKMATE:
+        return score + ply if score > 0 else score - ply
+    return score
+
 
+def scoreFromTable(score, ply):
+    """
+    Search score at this ply of a score read from the transposition table, see scoreToTable
+    """
+    if MATE_BOUND < abs(score) < CHECKMATE:
+        return score - ply if score > 0 else score + ply
     return score
+
+
+def scoreMaterial(gs):
+    """
+    Material and piece position score, without looking for checkmate or stalemate.
+    GameState keeps this total up to date on every move, so it costs nothing to read
+    """
+    if DEBUG_EVAL:
+        fullScore = scanBoard(gs.board)
+        if gs.materialScore != fullScore:
+            raise AssertionError("incremental score %d differs from board scan %d after %s"
+                                 % (gs.materialScore, fullScore, [str(move) for move in gs.moveLog]))
+    return gs.materialScore
@@ -0,0 +1,168 @@
+"""
+Batch analysis without a display.
+Reads a file of positions, one per line as FEN or EPD, searches each of them and writes one JSON line
+per position: best move, score, principal variation and the search statistics. Positions are spread over
+a pool of processes and the input is streamed, so files of any length can be analysed.
+
+    python analyze.py positions.epd --depth 4 --processes 8 --output results.jsonl
+    python analyze.py positions.fen --movetime 2 --tablebase tables
+
+EPD operations are kept in the output, with "bm" and "am" (best and avoid moves in SAN) the result
+also says whether the search solved the position. Blank lines and lines starting with # are skipped.
+Every position is searched from an empty transposition table, so results don't depend on which process
+got which positions before.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from multiprocessing import Pool
+
+import ai
+from book import parseSan
+from engine import GameState
+from transposition import DEFAULT_HASH_MB
+
+POSITIONS_AHEAD = 64  # positions handed to the pool before their results are written, per process
+OPERATION_PATTERN = re.compile(r'\s*([A-Za-z]\w*)\s*((?:"[^"]*"|[^;"])*);')
+
+
+def parseLine(line):
+    """
+    (FEN, EPD operations) of a FEN or EPD line. The move counters of an EPD line are taken from its
+    hmvc and fmvn operations when it has them
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("not a FEN or EPD position: " + line)
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = rest.split()
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        return " ".join(fields[:4] + counters[:2]), {}
+    if rest.strip() and not rest.rstrip().endswith(";"):
+        rest += ";"  # the last operation may go without its semicolon
+    operations = {}
+    for name, operand in OPERATION_PATTERN.findall(rest):
+        operations[name] = operand.strip().strip('"')
+    fen = " ".join(fields[:4] + [operations.get("hmvc", "0"), operations.get("fmvn", "1")])
+    return fen, operations
+
+
+def readPositions(path):
+    """
+    Yields (line number, line) for every position of the file, - reads standard input
+    """
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for number, line in enumerate(source, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield number, line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def startProcess(hashMB, tablebasePath):
+    """
+    Runs once in every pool process
+    """
+    ai.setHashSize(hashMB)
+    ai.setTablebase(tablebasePath)
+
+
+def analysePosition(job):
+    """
+    Search one position of the file, returns the result as a dictionary. A line that can't be read gives
+    a result with an error instead of stopping the whole run
+    """
+    number, line, depth, moveTime = job
+    try:
+        return searchLine(number, line, depth, moveTime)
+    except (ValueError, KeyError) as error:
+        return {"line": number, "error": str(error)}
+
+
+def searchLine(number, line, depth, moveTime):
+    """
+    Result of one position, raises ValueError or KeyError for a line that isn't a valid position
+    """
+    result = {"line": number}
+    fen, operations = parseLine(line)
+    gs = GameState(fen)
+    result["fen"] = fen
+    if operations:
+        result["operations"] = operations
+    validMoves = gs.getValidMoves()
+    if not validMoves:
+        result["bestMove"] = None
+        result["result"] = "checkmate" if gs.inCheck() else "stalemate"
+        return result
+
+    ai.transpositionTable.clear()
+    ai.historyTable[:] = [0] * len(ai.historyTable)
+    move, stats = ai.findBestMove(gs, validMoves, None, moveTime=moveTime, maxDepth=depth)
+    last = stats.iterations[-1] if stats.iterations else {"depth": 0, "score": None, "pv": [move.getChessNotation()]}
+    result["bestMove"] = move.getChessNotation()
+    result["score"] = last["score"]
+    result["depth"] = last["depth"]
+    result["pv"] = last["pv"]
+    if "bm" in operations or "am" in operations:
+        bestMoves = [parseSan(gs, san, validMoves) for san in operations.get("bm", "").split()]
+        avoidMoves = [parseSan(gs, san, validMoves) for san in operations.get("am", "").split()]
+        result["solved"] = (not bestMoves or move in bestMoves) and move not in avoidMoves
+    statistics = stats.asDict()
+    del statistics["iterations"]
+    result["stats"] = statistics
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("positions", help="FEN or EPD file, one position per line, - for standard input")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--depth", type=int, help="plies to search each position (default %d)" % ai.DEPTH)
+    limit.add_argument("--movetime", type=float, help="seconds to search each position")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="search processes (default: all cores)")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help="transposition table MB per process")
+    parser.add_argument("--tablebase", help="directory of endgame tables (see tablebase.py)")
+    parser.add_argument("--output", help="JSON lines file to write, standard output by default")
+    args = parser.parse_args()
+    if args.depth is not None and args.depth < 1:
+        parser.error("depth must be at least 1")
+
+    # under a time limit the search deepens until the time is used, otherwise it stops at the depth
+    depth = args.depth if args.movetime is None else None
+    # the pool would read the whole file at once, only let it get so far ahead of the results
+    ahead = threading.Semaphore(POSITIONS_AHEAD * args.processes)
+
+    def jobs():
+        for number, line in readPositions(args.positions):
+            ahead.acquire()
+            yield number, line, depth, args.movetime
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    solved = total = 0
+    try:
+        with Pool(args.processes, startProcess, (args.hash, args.tablebase)) as pool:
+            # results come back in input order, while the pool works ahead on the positions after a slow one
+            for result in pool.imap(analysePosition, jobs(), chunksize=4):
+                ahead.release()
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                if "solved" in result:
+                    total += 1
+                    solved += result["solved"]
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if total:
+        print("solved %d of %d" % (solved, total), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
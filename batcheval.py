@@ -0,0 +1,139 @@
+"""
+Batch evaluation with NumPy, for offline analysis and tuning over many positions at once.
+Positions are encoded as piece planes, an (N, 12, 64) array of 0/1 with one plane per piece of PIECES,
+or as squares, an (N, 64) int8 array holding 0 for an empty square and 1 + the index in PIECES of the
+piece on it. Both give the material and piece position score of every position in one vectorised step,
+the same numbers as scanBoard (evaluation.py) gives one board at a time.
+evaluate takes GameStates and scores them like ai.scoreBoard, checkmate and stalemate included.
+
+    python batcheval.py --positions 200000
+
+benchmarks the batch evaluation against scanBoard. NumPy is only needed by this module:
+
+    pip install numpy
+"""
+
+import argparse
+import random
+import time
+
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError("batcheval.py needs NumPy: pip install numpy") from error
+
+import ai
+from engine import GameState
+from evaluation import PIECE_SQUARE_VALUES, scanBoard
+
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+# score of every piece on every square, plane order
+PLANE_VALUES = np.array([PIECE_SQUARE_VALUES[piece] for piece in PIECES], dtype=np.int32)
+# the same by square code, code 0 (empty square) scores nothing
+CODE_VALUES = np.vstack([np.zeros(64, dtype=np.int32), PLANE_VALUES])
+SQUARES = np.arange(64)
+
+
+def encodePlanes(gameStates):
+    """
+    (N, 12, 64) uint8 piece planes of the GameStates, unpacked from their bitboards
+    """
+    bitboards = np.array([[gs.pieceBitboards[piece] for piece in PIECES] for gs in gameStates], dtype="<u8")
+    return np.unpackbits(bitboards.view(np.uint8).reshape(-1, 12, 8), axis=2, bitorder="little")
+
+
+def planesToSquares(planes):
+    """
+    (N, 64) int8 squares of (N, 12, 64) piece planes
+    """
+    codes = np.arange(1, 13, dtype=np.int8)
+    return np.einsum("nps,p->ns", planes.astype(np.int8), codes)
+
+
+def evaluatePlanes(planes):
+    """
+    Material and piece position score of every position of (N, 12, 64) piece planes, as int32
+    """
+    # integer einsum reads the uint8 planes as they are, a matmul would copy them to a wider type first
+    return np.einsum("nps,ps->n", planes, PLANE_VALUES)
+
+
+def evaluateSquares(squares):
+    """
+    Material and piece position score of every position of (N, 64) squares, as int32
+    """
+    return CODE_VALUES[squares, SQUARES].sum(axis=1, dtype=np.int32)
+
+
+def evaluate(gameStates):
+    """
+    ai.scoreBoard of every GameState as an int32 array, a positive score is good for white.
+    Like scoreBoard it reads the checkmate and stalemate flags, which getValidMoves sets
+    """
+    scores = evaluatePlanes(encodePlanes(gameStates))
+    checkmates = np.array([gs.checkmate for gs in gameStates], dtype=bool)
+    stalemates = np.array([gs.stalemate for gs in gameStates], dtype=bool)
+    whiteToMove = np.array([gs.whiteToMove for gs in gameStates], dtype=bool)
+    scores[stalemates] = ai.STALEMATE
+    scores[checkmates] = np.where(whiteToMove[checkmates], -ai.CHECKMATE, ai.CHECKMATE)
+    return scores
+
+
+def randomPositions(count, seed):
+    """
+    GameStates met in random games from the starting position. getValidMoves has been called on each,
+    so their checkmate and stalemate flags are set
+    """
+    rng = random.Random(seed)
+    positions = []
+    gs = GameState()
+    while len(positions) < count:
+        validMoves = gs.getValidMoves()
+        positions.append(GameState(gs.getFen()))
+        positions[-1].getValidMoves()
+        if not validMoves or len(gs.moveLog) >= 150:
+            gs = GameState()
+        else:
+            gs.makeMove(rng.choice(validMoves))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--positions", type=int, default=200000, help="positions to evaluate")
+    parser.add_argument("--distinct", type=int, default=2000, help="distinct positions, repeated to --positions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    gameStates = randomPositions(args.distinct, args.seed)
+    gameStates = (gameStates * (args.positions // len(gameStates) + 1))[:args.positions]
+    boards = [gs.board for gs in gameStates]
+
+    start = time.perf_counter()
+    expected = [scanBoard(board) for board in boards]
+    scalarTime = time.perf_counter() - start
+    start = time.perf_counter()
+    planes = encodePlanes(gameStates)
+    encodeTime = time.perf_counter() - start
+    squares = planesToSquares(planes)
+    start = time.perf_counter()
+    planeScores = evaluatePlanes(planes)
+    planeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    squareScores = evaluateSquares(squares)
+    squareTime = time.perf_counter() - start
+
+    expected = np.array(expected, dtype=np.int32)
+    if not (np.array_equal(planeScores, expected) and np.array_equal(squareScores, expected)):
+        raise AssertionError("batch scores differ from scanBoard")
+    if not np.array_equal(evaluate(gameStates), [ai.scoreBoard(gs) for gs in gameStates]):
+        raise AssertionError("batch scores differ from scoreBoard")
+
+    print("%d positions, all scores equal to scanBoard and scoreBoard" % len(gameStates))
+    for name, seconds in (("scanBoard", scalarTime), ("encodePlanes", encodeTime),
+                          ("evaluatePlanes", planeTime), ("evaluateSquares", squareTime)):
+        print("%-16s %8.3fs %10.0f positions/s" % (name, seconds, len(gameStates) / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Search benchmark.
+Runs fixed-depth searches on a few positions and reports nodes, time and nodes per second.
+With --compare FLAG every position is searched with an ai.py switch off and then on, so the effect
+of a single search feature is visible, e.g.
+
+    python bench.py --depth 3 --compare MOVE_ORDERING
+
+With --threads the same searches run under Lazy SMP (smp.py) for each worker count, which gives
+a time-to-depth scaling report, e.g.
+
+    python bench.py --depth 4 --threads 1,2,4,8,16
+
+With --profile the searches run under cProfile and the most expensive functions are listed.
+"""
+
+import argparse
+import cProfile
+import pstats
+import random
+
+import ai
+from engine import GameState
+from smp import LazySMP
+
+# opening lines in coordinate notation, played from the starting position
+POSITIONS = {
+    "start": "",
+    "italian": "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 d2d3 f8c5",
+    "queens gambit": "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 e8g8",
+    "sicilian": "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6",
+    "open centre": "e2e4 e7e5 d2d4 e5d4 d1d4 b8c6 d4e3 g8f6 b1c3 f8b4 c1d2 e8g8",
+}
+
+
+class ResultHolder:
+    """
+    Stands in for the returnQueue of findBestMove
+    """
+    def put(self, result):
+        self.move, self.stats = result
+
+
+def playLine(line):
+    gs = GameState()
+    for notation in line.split():
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == notation:
+                gs.makeMove(move)
+                break
+        else:
+            raise ValueError("illegal move in benchmark line: " + notation)
+    return gs
+
+
+def runSearch(gs, depth, search=ai.findBestMove, profiler=None):
+    """
+    One search from a cold table, returns (move, SearchStats)
+    """
+    ai.transpositionTable.clear()
+    ai.historyTable[:] = [0] * len(ai.historyTable)
+    random.seed(0)
+    result = ResultHolder()
+    search(gs, gs.getValidMoves(), result, maxDepth=depth, profiler=profiler)
+    return result.move, result.stats
+
+
+def scalingReport(depth, threadCounts):
+    """
+    Time to reach depth on every position for each number of search processes, against one process.
+    The single process also runs through LazySMP, so every row uses the same shared table
+    """
+    baseline = None
+    for threads in threadCounts:
+        smp = LazySMP(threads)
+        try:
+            nodes = 0
+            seconds = 0.0
+            for name, line in POSITIONS.items():
+                gs = playLine(line)
+                move, stats = runSearch(gs, depth, smp.findBestMove)
+                nodes += stats.nodes + smp.helperNodeCount
+                seconds += stats.elapsed
+                print("%-40s %-6s %9d nodes %7.2fs" % ("%s (%d threads)" % (name, threads), move,
+                                                        stats.nodes + smp.helperNodeCount, stats.elapsed))
+        finally:
+            smp.close()
+        if baseline is None:
+            baseline = seconds
+        print("%-40s %-6s %9d nodes %7.2fs %8.0f nps  speedup %.2f" % ("total (%d threads)" % threads, "", nodes,
+                                                                         seconds, nodes / seconds, baseline / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--compare", metavar="FLAG", help="ai.py switch to search with off and on")
+    parser.add_argument("--threads", metavar="COUNTS", help="comma separated search process counts to compare")
+    parser.add_argument("--profile", action="store_true", help="run the searches under cProfile")
+    args = parser.parse_args()
+
+    if args.threads:
+        scalingReport(args.depth, [int(count) for count in args.threads.split(",")])
+        return
+
+    settings = [None]
+    if args.compare:
+        if not isinstance(getattr(ai, args.compare, None), bool):
+            parser.error("ai.%s is not a search switch" % args.compare)
+        settings = [False, True]
+
+    profiler = cProfile.Profile() if args.profile else None
+    totals = {setting: [0, 0.0, 0, 0] for setting in settings}
+    for name, line in POSITIONS.items():
+        gs = playLine(line)
+        for setting in settings:
+            if setting is not None:
+                setattr(ai, args.compare, setting)
+            move, stats = runSearch(gs, args.depth, profiler=profiler)
+            total = totals[setting]
+            total[0] += stats.nodes
+            total[1] += stats.elapsed
+            total[2] += stats.betaCutoffs
+            total[3] += stats.firstMoveCutoffs
+            label = name if setting is None else "%s (%s=%s)" % (name, args.compare, setting)
+            print("%-40s %-6s %9d nodes %7.2fs %8.0f nps %5.1f%% first move cutoffs"
+                  % (label, move, stats.nodes, stats.elapsed, stats.nodes / stats.elapsed,
+                     100 * stats.getFirstMoveCutoffRate()))
+
+    for setting, (nodes, seconds, cutoffs, firstMoveCutoffs) in totals.items():
+        label = "total" if setting is None else "total (%s=%s)" % (args.compare, setting)
+        print("%-40s %-6s %9d nodes %7.2fs %8.0f nps %5.1f%% first move cutoffs"
+              % (label, "", nodes, seconds, nodes / seconds, 100 * firstMoveCutoffs / cutoffs if cutoffs else 0))
+
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+if __name__ == "__main__":
+    main()
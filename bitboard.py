@@ -0,0 +1,158 @@
+"""
+Precomputed bitboard tables used by the move generator.
+A bitboard is a 64-bit integer with one bit per square. Squares are numbered in the same order as
+GameState.board is laid out: square = row * 8 + col, so a8 is square 0 and h1 is square 63.
+"""
+
+FULL_BOARD = (1 << 64) - 1
+
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL_BOARD ^ FILE_A
+NOT_FILE_H = FULL_BOARD ^ FILE_H
+
+# (row, col) steps of each sliding direction
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, 1), (1, -1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+
+def squareBit(r, c):
+    """
+    Returns the bitboard with only the square at row and column set
+    """
+    return 1 << (r * 8 + c)
+
+
+def popCount(bb):
+    return bin(bb).count("1")
+
+
+def _stepTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                bb |= squareBit(r + dr, c + dc)
+        table.append(bb)
+    return table
+
+
+def _ray(sq, direction, occupied=0):
+    """
+    Squares reached from sq in one direction, stopping at (and including) the first occupied square
+    """
+    r, c = divmod(sq, 8)
+    bb = 0
+    while True:
+        r += direction[0]
+        c += direction[1]
+        if not (0 <= r <= 7 and 0 <= c <= 7):
+            return bb
+        bit = squareBit(r, c)
+        bb |= bit
+        if occupied & bit:
+            return bb
+
+
+def _betweenTable():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            r, c = divmod(sq, 8)
+            between = 0
+            while 0 <= r + direction[0] <= 7 and 0 <= c + direction[1] <= 7:
+                r += direction[0]
+                c += direction[1]
+                table[sq][r * 8 + c] = between
+                between |= squareBit(r, c)
+    return table
+
+
+def _lastSquare(sq, direction):
+    r, c = divmod(sq, 8)
+    bb = 0
+    while 0 <= r + direction[0] <= 7 and 0 <= c + direction[1] <= 7:
+        r += direction[0]
+        c += direction[1]
+        bb = squareBit(r, c)
+    return bb
+
+
+def _lineTables(directions):
+    """
+    For each square, build one lookup per line (pair of opposite directions) through it.
+    Each lookup maps the occupancy of the line's inner squares to the attacked squares on that line,
+    so a sliding attack is one dictionary lookup per line instead of a walk along the ray.
+    """
+    masks = []
+    tables = []
+    for sq in range(64):
+        squareMasks = []
+        squareTables = []
+        for direction in directions:
+            opposite = (-direction[0], -direction[1])
+            full = _ray(sq, direction) | _ray(sq, opposite)
+            # the last square of each ray never blocks anything behind it
+            edges = _lastSquare(sq, direction) | _lastSquare(sq, opposite)
+            mask = full & ~edges
+            table = {}
+            subset = 0
+            while True:
+                table[subset] = _ray(sq, direction, subset) | _ray(sq, opposite, subset)
+                subset = (subset - mask) & mask
+                if subset == 0:
+                    break
+            squareMasks.append(mask)
+            squareTables.append(table)
+        masks.append(tuple(squareMasks))
+        tables.append(tuple(squareTables))
+    return masks, tables
+
+
+KNIGHT_ATTACKS = _stepTable(KNIGHT_OFFSETS)
+KING_ATTACKS = _stepTable(KING_OFFSETS)
+# squares a pawn of the given color attacks from each square
+PAWN_ATTACKS = {
+    'w': _stepTable(((-1, -1), (-1, 1))),
+    'b': _stepTable(((1, -1), (1, 1)))
+}
+
+# squares strictly between two squares on a common rank, file or diagonal, 0 otherwise
+BETWEEN = _betweenTable()
+
+# (rank, file) and (diagonal, anti-diagonal) pairs of lines
+ROOK_LINE_MASKS, ROOK_LINE_ATTACKS = _lineTables(((0, 1), (1, 0)))
+BISHOP_LINE_MASKS, BISHOP_LINE_ATTACKS = _lineTables(((1, 1), (1, -1)))
+
+# attacks on an empty board
+ROOK_RAYS = [rook[0][0] | rook[1][0] for rook in ROOK_LINE_ATTACKS]
+BISHOP_RAYS = [bishop[0][0] | bishop[1][0] for bishop in BISHOP_LINE_ATTACKS]
+
+
+def pawnAttacks(color, pawns):
+    """
+    All squares attacked by a set of pawns of the given color at once
+    """
+    if color == 'w':
+        return ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+    return (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & FULL_BOARD
+
+
+def rookAttacks(sq, occupied):
+    masks = ROOK_LINE_MASKS[sq]
+    tables = ROOK_LINE_ATTACKS[sq]
+    return tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]
+
+
+def bishopAttacks(sq, occupied):
+    masks = BISHOP_LINE_MASKS[sq]
+    tables = BISHOP_LINE_ATTACKS[sq]
+    return tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]
+
+
+def queenAttacks(sq, occupied):
+    return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
@@ -0,0 +1,254 @@
+"""
+Opening book.
+A book file borrows the entry layout and move encoding of Polyglot: 16-byte big-endian entries
+(key, move, weight, learn), sorted by key. It is not a Polyglot book: the keys come from the Zobrist keys
+of zobrist.py, not from the Polyglot random table, so Polyglot tools can't read these books and this
+module can't read theirs. Books are built from PGN files with this module.
+Like Polyglot, the key only includes the en passant file when a pawn can capture en passant, so a
+position reached by a double step and the same position read from a FEN without its en passant square
+share entries. The file is opened with mmap and searched by bisection: nothing is parsed at startup
+and processes reading the same book share its pages.
+
+    python book.py build games.pgn --output book.bin --plies 20
+    python book.py probe --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+"""
+
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+
+from engine import GameState, Move
+from zobrist import ENPASSANT_KEYS
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+PROMOTION_PIECES = {"N": 1, "B": 2, "R": 3, "Q": 4}
+
+
+def encodeMove(move):
+    """
+    Polyglot move: to file (bits 0-2), to rank (3-5), from file (6-8), from rank (9-11) and promotion
+    piece (12-14), ranks counted from white's side. Castling is written as the king taking its own rook
+    """
+    toCol = move.endCol
+    if move.isCastleMove:
+        toCol = 7 if move.endCol == 6 else 0
+    code = toCol | (7 - move.endRow) << 3 | move.startCol << 6 | (7 - move.startRow) << 9
+    if move.isPawnPromotion:
+        code |= PROMOTION_PIECES["Q"] << 12
+    return code
+
+
+def bookKey(gs):
+    """
+    Key of the position in a book: GameState.zobristKey, without the en passant file when no pawn of the
+    side to move stands next to the pawn that just made a double step
+    """
+    key = gs.zobristKey
+    if gs.enpassantPossible:
+        row, col = gs.enpassantPossible
+        pawnRow, pawn = (row + 1, "wp") if gs.whiteToMove else (row - 1, "bp")
+        neighbours = [pawnRow * 8 + c for c in (col - 1, col + 1) if 0 <= c < 8]
+        if not any(gs.pieceBitboards[pawn] >> sq & 1 for sq in neighbours):
+            key ^= ENPASSANT_KEYS[col]
+    return key
+
+
+class OpeningBook:
+    def __init__(self, path):
+        """
+        Open a book file built by buildBook
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY.size:
+            self.file.close()
+            raise ValueError("%s is not a book file, its size is not a multiple of %d" % (path, ENTRY.size))
+        # an empty file can't be mapped, it just has no entries
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.count = size // ENTRY.size
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def getEntries(self, key):
+        """
+        (move, weight) of every entry for the key, found by bisection over the sorted entries
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            entryKey, move, weight, learn = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def getMoves(self, gs, validMoves=None):
+        """
+        (Move, weight) of the book moves in the position that are valid here
+        """
+        entries = self.getEntries(bookKey(gs))
+        if not entries:
+            return []
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        movesByCode = {encodeMove(move): move for move in validMoves}
+        return [(movesByCode[code], weight) for code, weight in entries if code in movesByCode and weight > 0]
+
+    def chooseMove(self, gs, validMoves=None):
+        """
+        A book move picked at random with its weight as probability, or None when out of book
+        """
+        moves = self.getMoves(gs, validMoves)
+        if not moves:
+            return None
+        return random.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+def parseSan(gs, san, validMoves=None):
+    """
+    The valid move written in standard algebraic notation (e.g. "Nbd7", "exd5", "O-O", "e8=Q+"),
+    or None if it isn't one. Underpromotions are never valid, pawns always promote to a queen here
+    """
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(san) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        return None
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        return None
+    piece, fromFile, fromRank, square, promotion = match.groups()
+    piece = piece or "p"
+    if promotion is not None and promotion != "Q":
+        return None
+    endRow, endCol = Move.ranksToRows[square[1]], Move.filesToCols[square[0]]
+    candidates = [move for move in validMoves
+                  if move.pieceMoved[1] == piece and move.endRow == endRow and move.endCol == endCol
+                  and (fromFile is None or move.startCol == Move.filesToCols[fromFile])
+                  and (fromRank is None or move.startRow == Move.ranksToRows[fromRank])]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def readGames(path):
+    """
+    Yields (moves in SAN, result) for every game of a PGN file. Comments, variations, move numbers
+    and annotations are dropped
+    """
+    with open(path, encoding="utf-8", errors="replace") as pgn:
+        text = pgn.read()
+    # comments and variations can span lines and hold anything, remove them first (variations may nest)
+    text = re.sub(r"\{[^}]*\}|;[^\n]*", " ", text)
+    while True:
+        text, removed = re.subn(r"\([^()]*\)", " ", text)
+        if not removed:
+            break
+    moves = []
+    result = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("["):
+            if line.startswith("[Result "):
+                result = line.split('"')[1]
+            if moves:
+                yield moves, result
+                moves = []
+            continue
+        for token in line.split():
+            if token in ("1-0", "0-1", "1/2-1/2", "*"):
+                yield moves, result if result is not None else token
+                moves = []
+                result = None
+            elif not re.match(r"^(\d+\.+|\$\d+)$", token):
+                moves.append(re.sub(r"^\d+\.+", "", token))
+    if moves:
+        yield moves, result
+
+
+def buildBook(pgnPaths, outputPath, plies=20):
+    """
+    Compile the first plies moves of every game into a book. A move weighs 2 for each game its side won
+    and 1 for each draw or unknown result, moves that only ever lost are left out.
+    Returns the number of entries written
+    """
+    weights = {}
+    for path in pgnPaths:
+        for moves, result in readGames(path):
+            points = {"1-0": (2, 0), "0-1": (0, 2)}.get(result, (1, 1))
+            gs = GameState()
+            for san in moves[:plies]:
+                move = parseSan(gs, san)
+                if move is None:
+                    break  # illegal, ambiguous or an underpromotion, the rest of the game can't be followed
+                entry = (bookKey(gs), encodeMove(move))
+                weights[entry] = weights.get(entry, 0) + points[0 if gs.whiteToMove else 1]
+                gs.makeMove(move)
+
+    # weights are 16 bits, scale down the moves of positions that were played more often than that
+    highest = {}
+    for (key, code), weight in weights.items():
+        highest[key] = max(highest.get(key, 0), weight)
+    entries = []
+    for (key, code), weight in weights.items():
+        if highest[key] > MAX_WEIGHT:
+            weight = weight * MAX_WEIGHT // highest[key]
+        if weight > 0:
+            entries.append((key, -weight, code))
+    entries.sort()
+    with open(outputPath, "wb") as book:
+        for key, weight, code in entries:
+            book.write(ENTRY.pack(key, code, -weight, 0))
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile PGN files into a book")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="moves of each game that go into the book")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("--book", default="book.bin")
+    probe.add_argument("--fen", help="the initial position by default")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = buildBook(args.pgn, args.output, args.plies)
+        print("%d entries written to %s" % (count, args.output))
+    else:
+        book = OpeningBook(args.book)
+        gs = GameState(args.fen)
+        moves = book.getMoves(gs)
+        total = sum(weight for move, weight in moves)
+        for move, weight in sorted(moves, key=lambda moveWeight: -moveWeight[1]):
+            print("%-6s %-6s %5d %5.1f%%" % (move.getChessNotation(), move, weight, 100 * weight / total))
+        if not moves:
+            print("not in book")
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
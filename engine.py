@@ -3,14 +3,28 @@ This class is responsible for storing all information about the current state of
 It validates valid moves and keeps a move log.
 """
 
+from bitboard import (KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS, BETWEEN, FULL_BOARD,
+                      pawnAttacks, rookAttacks, bishopAttacks, queenAttacks)
+from evaluation import PIECE_SQUARE_VALUES, scanBoard
+from zobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLING_KEYS, ENPASSANT_KEYS, castlingIndex, computeKey
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
 
 class GameState:
-    def __init__(self):
+    def __init__(self, fen=None):
         """
         Board is a 8x8 2d list, each element in list has 2 characters.
         The first character represents the color of the piece: 'b' or 'w'.
         The second character represents the type of the piece: 'R', 'N', 'B', 'Q', 'K' or 'p'.
         "--" represents an empty space with no piece.
+
+        The position itself is held in bitboards: one 64-bit integer per piece (e.g. 'wN') and per color,
+        with square = row * 8 + col. The board list is a view of the same position, kept in step by
+        putPiece and removePiece, so drawing code can keep indexing board[row][col].
+        zobristKey hashes the position and materialScore holds the material and piece position score
+        (see evaluation.py), both are updated incrementally by makeMove and undoMove.
+        Pass a FEN string to start from another position than the initial one.
         """
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -21,6 +35,9 @@ class GameState:
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
+        self.pieceBitboards = {}
+        self.colorBitboards = {}
+        self.updateBitboards()
         self.moveFunctions = {
             'p': self.getPawnMoves,
             'R': self.getRookMoves,
@@ -40,55 +57,202 @@ class GameState:
         self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                              self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
         self.moveLog = []
+        # move counters of the starting position, the current ones are worked out from the move log
+        self.startHalfmoveClock = 0
+        self.startFullmoveNumber = 1
+        self.zobristKey = computeKey(self)
+        self.materialScore = scanBoard(self.board)
+        if fen is not None:
+            self.loadFen(fen)
+
+    def loadFen(self, fen):
+        """
+        Set up the position described by a FEN string, the move log is cleared.
+        Raises ValueError for a FEN that can't be read, or whose kings, pawns, castling rights or en passant
+        square don't fit the position
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("invalid FEN: " + fen)
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("invalid FEN: " + fen)
+        board = []
+        for row in rows:
+            boardRow = []
+            for char in row:
+                if char.isdigit():
+                    boardRow.extend(["--"] * int(char))
+                elif char.lower() in "prnbqk":
+                    piece = char.upper() if char.lower() != "p" else "p"
+                    boardRow.append(("w" if char.isupper() else "b") + piece)
+                else:
+                    raise ValueError("invalid FEN: " + fen)
+            if len(boardRow) != 8:
+                raise ValueError("invalid FEN: " + fen)
+            board.append(boardRow)
+        for king in ("wK", "bK"):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError("invalid FEN, there must be exactly one %s king: %s"
+                                 % ("white" if king == "wK" else "black", fen))
+        if any(piece[1] == "p" for piece in board[0] + board[7]):
+            raise ValueError("invalid FEN, pawns can't stand on the first or last rank: " + fen)
+        if fields[1] not in ("w", "b"):
+            raise ValueError("invalid FEN, side to move must be w or b: " + fen)
+        castling = fields[2]
+        if castling != "-" and (not castling or any(right not in "KQkq" for right in castling)):
+            raise ValueError("invalid FEN, castling rights must be - or letters of KQkq: " + fen)
+        # (right, king square, rook square) on the board list, row 7 is the first rank
+        for right, (kingRow, kingCol), (rookRow, rookCol) in (("K", (7, 4), (7, 7)), ("Q", (7, 4), (7, 0)),
+                                                              ("k", (0, 4), (0, 7)), ("q", (0, 4), (0, 0))):
+            color = "w" if right.isupper() else "b"
+            if right in castling and (board[kingRow][kingCol] != color + "K" or board[rookRow][rookCol] != color + "R"):
+                raise ValueError("invalid FEN, castling right %s without king and rook on their squares: %s"
+                                 % (right, fen))
+        enpassant = fields[3]
+        # the square passed over by a pawn of the side that just moved
+        if enpassant != "-" and (len(enpassant) != 2 or enpassant[0] not in "abcdefgh"
+                                 or enpassant[1] != ("6" if fields[1] == "w" else "3")):
+            raise ValueError("invalid FEN, en passant square must be - or a square on rank %s: %s"
+                             % ("6" if fields[1] == "w" else "3", fen))
+
+        self.board = board
+        self.updateBitboards()
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        # the side that just moved can't have left its king in check, the king could be taken
+        waitingKing = self.pieceBitboards["bK" if fields[1] == "w" else "wK"].bit_length() - 1
+        if self.isSquareAttacked(waitingKing, fields[1], self.colorBitboards["w"] | self.colorBitboards["b"]):
+            raise ValueError("invalid FEN, the side not to move is in check: " + fen)
+        self.whiteToMove = fields[1] == "w"
+        self.currentCastlingRight = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        if enpassant != "-":
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        else:
+            self.enpassantPossible = ()
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.startHalfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.startFullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = computeKey(self)
+        self.materialScore = scanBoard(self.board)
+
+    def getFen(self):
+        """
+        The current position as a FEN string
+        """
+        rows = []
+        for boardRow in self.board:
+            row = ""
+            empty = 0
+            for piece in boardRow:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        castling = ""
+        if self.currentCastlingRight.wks:
+            castling += "K"
+        if self.currentCastlingRight.wqs:
+            castling += "Q"
+        if self.currentCastlingRight.bks:
+            castling += "k"
+        if self.currentCastlingRight.bqs:
+            castling += "q"
+
+        enpassant = "-"
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+
+        # the halfmove clock restarts on every pawn move and capture
+        halfmoveClock = self.startHalfmoveClock + len(self.moveLog)
+        for i in range(len(self.moveLog) - 1, -1, -1):
+            move = self.moveLog[i]
+            if move.pieceMoved[1] == "p" or move.isCapture:
+                halfmoveClock = len(self.moveLog) - 1 - i
+                break
+        # the fullmove number goes up after every black move
+        blackStarted = self.whiteToMove == (len(self.moveLog) % 2 == 1)
+        fullmoveNumber = self.startFullmoveNumber + (len(self.moveLog) + blackStarted) // 2
+
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.whiteToMove else "b", castling or "-",
+                                      enpassant, halfmoveClock, fullmoveNumber)
+
+    def getMoveFromNotation(self, notation):
+        """
+        The valid move written in coordinate notation (e.g. "e2e4"), or None if there is no such move.
+        A promotion suffix is accepted, pawns always promote to a queen
+        """
+        for move in self.getValidMoves():
+            if move.getChessNotation() == notation[:4]:
+                return move
+        return None
 
     def makeMove(self, move):
         """
-        Takes a Move as a parameter and executes it (won't work for castling, en-passant and pawn promotion)
+        Takes a Move as a parameter and executes it, including castling, en-passant and pawn promotion
         """
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        self.removePiece(move.startSq)
+        if move.isEnpassantMove:
+            # if enpassant move, capture pawn
+            self.removePiece(move.startSq & 56 | move.endSq & 7)
+        else:
+            self.removePiece(move.endSq)
+        # pawn promotion
+        if move.isPawnPromotion:
+            self.putPiece(move.endSq, move.pieceMoved[0] + 'Q')
+        else:
+            self.putPiece(move.endSq, move.pieceMoved)
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= BLACK_TO_MOVE_KEY
 
         # update king's position
         if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
+            self.whiteKingLocation = (move.endSq >> 3, move.endSq & 7)
         elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
-
-        # pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
-
-        # if enpassant move, capture pawn
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = '--'
+            self.blackKingLocation = (move.endSq >> 3, move.endSq & 7)
 
         # if pawn moves twice, next move can capture enpassant
         # only on 2-square pawn advances
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
+        if self.enpassantPossible:
+            self.zobristKey ^= ENPASSANT_KEYS[self.enpassantPossible[1]]
+        if move.pieceMoved[1] == 'p' and abs(move.startSq - move.endSq) == 16:
             self.enpassantPossible = (
-                (move.startRow + move.endRow) // 2, move.startCol)
+                (move.startSq + move.endSq) >> 4, move.startSq & 7)
+            self.zobristKey ^= ENPASSANT_KEYS[move.startSq & 7]
         else:
             self.enpassantPossible = ()
 
         # make castle move
         if move.isCastleMove:
-            if move.endCol - move.startCol == 2:  # king side
+            if move.endSq - move.startSq == 2:  # king side
                 # move the rook
-                self.board[move.endRow][move.endCol -
-                                        1] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol +
-                                        1] = '--'  # erase old rook
+                self.movePiece(move.endSq + 1, move.endSq - 1)
             else:  # queen side
-                self.board[move.endRow][move.endCol +
-                                        1] = self.board[move.endRow][move.endCol - 2]
-                self.board[move.endRow][move.endCol - 2] = '--'
+                self.movePiece(move.endSq - 2, move.endSq + 1)
 
         self.enpassantPossibleLog.append(self.enpassantPossible)
 
         # update castle rights
+        self.zobristKey ^= CASTLING_KEYS[castlingIndex(self.currentCastlingRight)]
         self.updateCastleRights(move)
+        self.zobristKey ^= CASTLING_KEYS[castlingIndex(self.currentCastlingRight)]
         self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                                  self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
 
@@ -98,72 +262,125 @@ class GameState:
         """
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.removePiece(move.endSq)
+            self.putPiece(move.startSq, move.pieceMoved)
+            if move.isEnpassantMove:
+                # undo enpassant move
+                self.putPiece(move.startSq & 56 | move.endSq & 7, move.pieceCaptured)
+            else:
+                self.putPiece(move.endSq, move.pieceCaptured)
             self.whiteToMove = not self.whiteToMove
+            self.zobristKey ^= BLACK_TO_MOVE_KEY
 
             # update king's position
             if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
+                self.whiteKingLocation = (move.startSq >> 3, move.startSq & 7)
             elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
-
-            # undo enpassant move
-            if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = '--'
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
+                self.blackKingLocation = (move.startSq >> 3, move.startSq & 7)
 
+            if self.enpassantPossible:
+                self.zobristKey ^= ENPASSANT_KEYS[self.enpassantPossible[1]]
             self.enpassantPossibleLog.pop()
             self.enpassantPossible = self.enpassantPossibleLog[-1]
+            if self.enpassantPossible:
+                self.zobristKey ^= ENPASSANT_KEYS[self.enpassantPossible[1]]
 
             # give back castle rights if move took them away
+            self.zobristKey ^= CASTLING_KEYS[castlingIndex(self.currentCastlingRight)]
             self.castleRightsLog.pop()
             self.currentCastlingRight = CastleRights(self.castleRightsLog[-1].wks, self.castleRightsLog[-1].bks,
                                                      self.castleRightsLog[-1].wqs, self.castleRightsLog[-1].bqs)
+            self.zobristKey ^= CASTLING_KEYS[castlingIndex(self.currentCastlingRight)]
 
             # undo castle move
             if move.isCastleMove:
-                if move.endCol - move.startCol == 2:  # king side
-                    self.board[move.endRow][move.endCol +
-                                            1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] = '--'
+                if move.endSq - move.startSq == 2:  # king side
+                    self.movePiece(move.endSq - 1, move.endSq + 1)
                 else:  # queen side
-                    self.board[move.endRow][move.endCol -
-                                            2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] = '--'
+                    self.movePiece(move.endSq + 1, move.endSq - 2)
 
             # undo possible game over
             self.checkmate = False
             self.stalemate = False
 
-    def getValidMoves(self):
+    def makeNullMove(self):
         """
-        All moves, considering checks.
-        1. Generates all possible moves
-        2. For each move, makes the move
-        3. Generates all opponent's moves
-        4. For each opponent move, check if your king is attacked
+        Pass the turn, for null move pruning in the search: only the side to move and the en passant
+        square change and nothing goes into the move log. Take it back with undoNullMove
         """
+        if self.enpassantPossible:
+            self.zobristKey ^= ENPASSANT_KEYS[self.enpassantPossible[1]]
+        self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= BLACK_TO_MOVE_KEY
 
-        tempEnpassantePossible = self.enpassantPossible
-        tempCurrentCastleRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                               self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
-        moves = self.getAllPossibleMoves()
+    def undoNullMove(self):
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= BLACK_TO_MOVE_KEY
+        self.enpassantPossibleLog.pop()
+        self.enpassantPossible = self.enpassantPossibleLog[-1]
+        if self.enpassantPossible:
+            self.zobristKey ^= ENPASSANT_KEYS[self.enpassantPossible[1]]
+        self.checkmate = False
+        self.stalemate = False
 
-        if self.whiteToMove:
-            self.getCastleMoves(
-                self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
-        else:
-            self.getCastleMoves(
-                self.blackKingLocation[0], self.blackKingLocation[1], moves)
-        for i in range(len(moves) - 1, -1, -1):
-            self.makeMove(moves[i])
+    def hasPieces(self, color):
+        """
+        The side has a piece other than pawns and king, without one zugzwang is likely
+        """
+        return bool(self.pieceBitboards[color + 'N'] | self.pieceBitboards[color + 'B'] |
+                    self.pieceBitboards[color + 'R'] | self.pieceBitboards[color + 'Q'])
 
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                moves.remove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+    def updateBitboards(self):
+        """
+        Rebuild every bitboard from the board list
+        """
+        for piece in ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK'):
+            self.pieceBitboards[piece] = 0
+        self.colorBitboards['w'] = 0
+        self.colorBitboards['b'] = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.pieceBitboards[piece] |= 1 << (r * 8 + c)
+                    self.colorBitboards[piece[0]] |= 1 << (r * 8 + c)
+
+    def putPiece(self, sq, piece):
+        """
+        Put a piece on an empty square, "--" is ignored
+        """
+        if piece != "--":
+            self.board[sq >> 3][sq & 7] = piece
+            bit = 1 << sq
+            self.pieceBitboards[piece] |= bit
+            self.colorBitboards[piece[0]] |= bit
+            self.zobristKey ^= PIECE_KEYS[piece][sq]
+            self.materialScore += PIECE_SQUARE_VALUES[piece][sq]
+
+    def removePiece(self, sq):
+        """
+        Clear a square and return the piece that was on it
+        """
+        piece = self.board[sq >> 3][sq & 7]
+        if piece != "--":
+            self.board[sq >> 3][sq & 7] = "--"
+            bit = 1 << sq
+            self.pieceBitboards[piece] ^= bit
+            self.colorBitboards[piece[0]] ^= bit
+            self.zobristKey ^= PIECE_KEYS[piece][sq]
+            self.materialScore -= PIECE_SQUARE_VALUES[piece][sq]
+        return piece
+
+    def movePiece(self, startSq, endSq):
+        self.putPiece(endSq, self.removePiece(startSq))
+
+    def getValidMoves(self):
+        """
+        All moves, considering checks. Also updates checkmate and stalemate
+        """
+        moves = self.getLegalMoves()
 
         if len(moves) == 0:
             if self.inCheck():
@@ -174,10 +391,149 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
-        self.enpassantPossible = tempEnpassantePossible
-        self.currentCastlingRight = tempCurrentCastleRights
         return moves
 
+    def getCaptureMoves(self):
+        """
+        Only the legal captures (including en passant), for the quiescence search.
+        Leaves checkmate and stalemate alone since quiet moves aren't looked at
+        """
+        return self.getLegalMoves(capturesOnly=True)
+
+    def getLegalMoves(self, capturesOnly=False):
+        """
+        Checkers and pinned pieces are worked out once for the position and only legal moves are generated:
+        1. In double check only the king can move
+        2. In single check other pieces must capture the checking piece or block the check
+        3. Pinned pieces can only move along the line between their king and the pinning piece
+        4. The king never steps onto a square the enemy attacks
+        """
+        allyColor, enemyColor = ("w", "b") if self.whiteToMove else ("b", "w")
+        kingBit = self.pieceBitboards[allyColor + "K"]
+        kingSq = kingBit.bit_length() - 1
+        allies = self.colorBitboards[allyColor]
+        enemies = self.colorBitboards[enemyColor]
+        occupied = allies | enemies
+        checkers = self.attackersTo(kingSq, enemyColor, occupied)
+        moves = []
+
+        if not checkers & (checkers - 1):  # not in double check
+            if checkers:
+                targetMask = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+            else:
+                targetMask = FULL_BOARD
+            targetMask &= enemies if capturesOnly else ~allies
+            pins = self.getPins(kingSq, allyColor, enemyColor, occupied)
+
+            pieces = allies ^ kingBit
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                r, c = sq >> 3, sq & 7
+                piece = self.board[r][c][1]
+                pinMask = pins.get(sq, FULL_BOARD)
+
+                if piece == "p":
+                    self.getLegalPawnMoves(r, c, targetMask & pinMask, kingSq, moves, capturesOnly)
+                    continue
+                elif piece == "N":
+                    attacks = KNIGHT_ATTACKS[sq]
+                elif piece == "B":
+                    attacks = bishopAttacks(sq, occupied)
+                elif piece == "R":
+                    attacks = rookAttacks(sq, occupied)
+                else:
+                    attacks = queenAttacks(sq, occupied)
+                self.addMoves(r, c, attacks & targetMask & pinMask, moves)
+
+        # the king is lifted off the board so it can't step back along the ray of a slider checking it
+        kingRow, kingCol = kingSq >> 3, kingSq & 7
+        attacked = self.getAttackMap(enemyColor, occupied ^ kingBit)
+        kingTargets = enemies if capturesOnly else ~allies
+        self.addMoves(kingRow, kingCol, KING_ATTACKS[kingSq] & kingTargets & ~attacked, moves)
+        if not checkers and not capturesOnly:
+            self.getCastleMoves(kingRow, kingCol, moves)
+
+        return moves
+
+    def getLegalPawnMoves(self, r, c, targetMask, kingSq, moves, capturesOnly=False):
+        """
+        Pawn moves restricted to the targetMask (check evasion squares and pin line)
+        """
+        sq = r * 8 + c
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        if self.whiteToMove:
+            color, enemy, step, startRow = "w", "b", -1, 6
+        else:
+            color, enemy, step, startRow = "b", "w", 1, 1
+
+        oneStep = sq + 8 * step
+        if not capturesOnly and not occupied & (1 << oneStep):  # 1 square pawn advance
+            if targetMask & (1 << oneStep):
+                moves.append(self.getMove((r, c), (r + step, c)))
+            twoStep = oneStep + 8 * step
+            if r == startRow and not occupied & (1 << twoStep) and targetMask & (1 << twoStep):
+                moves.append(self.getMove((r, c), (r + 2 * step, c)))
+
+        attacks = PAWN_ATTACKS[color][sq]
+        self.addMoves(r, c, attacks & self.colorBitboards[enemy] & targetMask, moves)  # captures
+        if self.enpassantPossible:
+            epRow, epCol = self.enpassantPossible
+            epBit = 1 << (epRow * 8 + epCol)
+            if attacks & epBit:
+                # en passant removes two pieces from the capturing rank, so check the resulting position directly
+                capturedBit = 1 << (r * 8 + epCol)
+                occupiedAfter = (occupied ^ (1 << sq) ^ capturedBit) | epBit
+                if not self.attackersTo(kingSq, enemy, occupiedAfter) & ~capturedBit & self.colorBitboards[enemy]:
+                    moves.append(self.getMove((r, c), self.enpassantPossible, isEnpassantMove=True))
+
+    def attackersTo(self, sq, enemyColor, occupied):
+        """
+        Bitboard of the enemy pieces attacking a square, sliders see through nothing but occupied
+        """
+        pb = self.pieceBitboards
+        allyColor = "b" if enemyColor == "w" else "w"
+        return ((PAWN_ATTACKS[allyColor][sq] & pb[enemyColor + "p"])
+                | (KNIGHT_ATTACKS[sq] & pb[enemyColor + "N"])
+                | (KING_ATTACKS[sq] & pb[enemyColor + "K"])
+                | (rookAttacks(sq, occupied) & (pb[enemyColor + "R"] | pb[enemyColor + "Q"]))
+                | (bishopAttacks(sq, occupied) & (pb[enemyColor + "B"] | pb[enemyColor + "Q"])))
+
+    def getAttackMap(self, color, occupied):
+        """
+        Every square attacked by the pieces of the given color
+        """
+        pb = self.pieceBitboards
+        attacked = pawnAttacks(color, pb[color + "p"]) | KING_ATTACKS[pb[color + "K"].bit_length() - 1]
+        for piece, attacks in (("N", None), ("B", bishopAttacks), ("R", rookAttacks), ("Q", queenAttacks)):
+            pieces = pb[color + piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                attacked |= KNIGHT_ATTACKS[sq] if attacks is None else attacks(sq, occupied)
+        return attacked
+
+    def getPins(self, kingSq, allyColor, enemyColor, occupied):
+        """
+        Maps the square of every pinned piece to the squares it may still move to:
+        the line between its king and the pinning piece, including capturing the pinner
+        """
+        pb = self.pieceBitboards
+        pins = {}
+        snipers = ((ROOK_RAYS[kingSq] & (pb[enemyColor + "R"] | pb[enemyColor + "Q"]))
+                   | (BISHOP_RAYS[kingSq] & (pb[enemyColor + "B"] | pb[enemyColor + "Q"])))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            between = BETWEEN[kingSq][bit.bit_length() - 1]
+            blockers = between & occupied
+            # exactly one piece in between and it is ours
+            if blockers and not blockers & (blockers - 1) and blockers & self.colorBitboards[allyColor]:
+                pins[blockers.bit_length() - 1] = between | bit
+        return pins
+
     def inCheck(self):
         """
         Determines if the current player is in check
@@ -191,14 +547,43 @@ class GameState:
         """
         Determines if the enemy can attack square at row and column
         """
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
+        enemyColor = "b" if self.whiteToMove else "w"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        return self.isSquareAttacked(r * 8 + c, enemyColor, occupied)
 
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+    def squaresUnderAttack(self, squares):
+        """
+        Determines if the enemy can attack any of the (row, col) squares
+        """
+        enemyColor = "b" if self.whiteToMove else "w"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        for r, c in squares:
+            if self.isSquareAttacked(r * 8 + c, enemyColor, occupied):
                 return True
+        return False
 
+    def isSquareAttacked(self, sq, enemyColor, occupied):
+        """
+        Looks outward from the square for each kind of attacker in turn
+        (knight jumps, pawn diagonals, king neighbours, then the rook and bishop rays)
+        and stops at the first one found
+        """
+        pb = self.pieceBitboards
+        if KNIGHT_ATTACKS[sq] & pb[enemyColor + "N"]:
+            return True
+        # enemy pawns attacking sq stand where one of our pawns on sq would attack
+        if PAWN_ATTACKS["b" if enemyColor == "w" else "w"][sq] & pb[enemyColor + "p"]:
+            return True
+        if KING_ATTACKS[sq] & pb[enemyColor + "K"]:
+            return True
+        # only look along the rays if a slider is on one of them at all
+        queens = pb[enemyColor + "Q"]
+        rooks = pb[enemyColor + "R"] | queens
+        if ROOK_RAYS[sq] & rooks and rookAttacks(sq, occupied) & rooks:
+            return True
+        bishops = pb[enemyColor + "B"] | queens
+        if BISHOP_RAYS[sq] & bishops and bishopAttacks(sq, occupied) & bishops:
+            return True
         return False
 
     def getAllPossibleMoves(self):
@@ -206,154 +591,114 @@ class GameState:
         All moves without considering checks
         """
         moves = []
+        pieces = self.colorBitboards["w" if self.whiteToMove else "b"]
 
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]  # either w or b
-
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
-                    piece = self.board[r][c][1]  # either p, R, N, B, K, Q
-                    self.moveFunctions[piece](r, c, moves)
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            r, c = sq >> 3, sq & 7
+            piece = self.board[r][c][1]  # either p, R, N, B, K, Q
+            self.moveFunctions[piece](r, c, moves)
 
         return moves
 
+    def addMoves(self, r, c, targets, moves):
+        """
+        Add a move from row, col to every square set in the targets bitboard
+        """
+        board = self.board
+        key = (r * 8 + c) | PIECE_CODES[board[r][c]] << 15
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            sq = bit.bit_length() - 1
+            moveKey = key | sq << 6 | PIECE_CODES[board[sq >> 3][sq & 7]] << 19
+            move = MOVE_CACHE.get(moveKey)
+            if move is None:
+                move = MOVE_CACHE[moveKey] = Move((r, c), (sq >> 3, sq & 7), board)
+            moves.append(move)
+
+    def getMove(self, startSq, endSq, isEnpassantMove=False, isCastleMove=False):
+        """
+        The shared Move instance for a move between two (row, col) squares in this position
+        """
+        board = self.board
+        moveKey = ((startSq[0] * 8 + startSq[1]) | (endSq[0] * 8 + endSq[1]) << 6
+                   | (isEnpassantMove * ENPASSANT_FLAG | isCastleMove * CASTLE_FLAG) << 12
+                   | PIECE_CODES[board[startSq[0]][startSq[1]]] << 15
+                   | PIECE_CODES[board[endSq[0]][endSq[1]]] << 19)
+        move = MOVE_CACHE.get(moveKey)
+        if move is None:
+            move = MOVE_CACHE[moveKey] = Move(startSq, endSq, board, isEnpassantMove, isCastleMove)
+        return move
+
     def getPawnMoves(self, r, c, moves):
         """
         Get all the pawn moves for the pawn located at row, col and add moves to the list
         """
+        sq = r * 8 + c
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
         if self.whiteToMove:
-            if self.board[r - 1][c] == "--":  # 1 square pawn advance
-                moves.append(Move((r, c), (r - 1, c), self.board))
-                if r == 6 and self.board[r - 2][c] == "--":  # 2 square pawn advance
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            if c - 1 >= 0:  # left capture
-                if self.board[r - 1][c - 1][0] == "b":
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.enpassantPossible:  # left enpassante
-                    moves.append(Move((r, c), (r - 1, c - 1),
-                                 self.board, isEnpassantMove=True))
-            if c + 1 <= 7:  # right capture
-                if self.board[r - 1][c + 1][0] == "b":
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.enpassantPossible:  # right enpassante
-                    moves.append(Move((r, c), (r - 1, c + 1),
-                                 self.board, isEnpassantMove=True))
-
+            color, enemy, step, startRow = "w", "b", -1, 6
         else:
-            if self.board[r + 1][c] == "--":  # 1 square pawn advance
-                moves.append(Move((r, c), (r + 1, c), self.board))
-                if r == 1 and self.board[r + 2][c] == "--":  # 2 square pawn advance
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            if c - 1 >= 0:  # right capture
-                if self.board[r + 1][c - 1][0] == "w":
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.enpassantPossible:  # right enpassante
-                    moves.append(Move((r, c), (r + 1, c - 1),
-                                 self.board, isEnpassantMove=True))
-            if c + 1 <= 7:  # left capture
-                if self.board[r + 1][c + 1][0] == "w":
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.enpassantPossible:  # left enpassante
-                    moves.append(Move((r, c), (r + 1, c + 1),
-                                 self.board, isEnpassantMove=True))
+            color, enemy, step, startRow = "b", "w", 1, 1
+
+        if not occupied & (1 << (sq + 8 * step)):  # 1 square pawn advance
+            moves.append(self.getMove((r, c), (r + step, c)))
+            if r == startRow and not occupied & (1 << (sq + 16 * step)):  # 2 square pawn advance
+                moves.append(self.getMove((r, c), (r + 2 * step, c)))
+
+        attacks = PAWN_ATTACKS[color][sq]
+        self.addMoves(r, c, attacks & self.colorBitboards[enemy], moves)  # captures
+        if self.enpassantPossible:
+            epRow, epCol = self.enpassantPossible
+            if attacks & (1 << (epRow * 8 + epCol)):
+                moves.append(self.getMove((r, c), self.enpassantPossible, isEnpassantMove=True))
 
     def getRookMoves(self, r, c, moves):
         """
         Get all the rook moves for the rook located at row, col and add moves to the list
         """
-        # up, left, down, right
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemyColor = "b" if self.whiteToMove else "w"
-
-        for direction in directions:
-            for i in range(1, 8):
-                endRow = r + direction[0] * i
-                endCol = c + direction[1] * i
-
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:  # check for possible moves only in boundaries of the board
-                    endPiece = self.board[endRow][endCol]
-
-                    if endPiece == "--":  # empty space is valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:  # capture enemy piece
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:  # friendly piece
-                        break
-                else:  # off board
-                    break
+        allyColor = "w" if self.whiteToMove else "b"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        targets = rookAttacks(r * 8 + c, occupied) & ~self.colorBitboards[allyColor]
+        self.addMoves(r, c, targets, moves)
 
     def getKnightMoves(self, r, c, moves):
         """
         Get all the knight moves for the knight located at row, col and add moves to the list
         """
-        directions = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2),
-                      # up/left up/right right/up right/down down/left down/right left/up left/down
-                      (1, -2))
         allyColor = "w" if self.whiteToMove else "b"
-
-        for move in directions:
-            endRow = r + move[0]
-            endCol = c + move[1]
-
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  # either enemy piece or empty square
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        # either enemy piece or empty square
+        targets = KNIGHT_ATTACKS[r * 8 + c] & ~self.colorBitboards[allyColor]
+        self.addMoves(r, c, targets, moves)
 
     def getBishopMoves(self, r, c, moves):
         """
         Get all the bishop moves for the bishop located at row, col and add moves to the list
         """
-        # diagonals: up/left up/right down/right down/left
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))
-        enemyColor = "b" if self.whiteToMove else "w"
-
-        for direction in directions:
-            for i in range(1, 8):
-                endRow = r + direction[0] * i
-                endCol = c + direction[1] * i
-
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:  # check if the move is on board
-                    endPiece = self.board[endRow][endCol]
-
-                    if endPiece == "--":  # empty space is valid
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:  # capture enemy piece
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:  # friendly piece
-                        break
-                else:  # off board
-                    break
+        allyColor = "w" if self.whiteToMove else "b"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        targets = bishopAttacks(r * 8 + c, occupied) & ~self.colorBitboards[allyColor]
+        self.addMoves(r, c, targets, moves)
 
     def getQueenMoves(self, r, c, moves):
         """
         Get all the queen moves for the queen located at row, col and add moves to the list
         """
-        self.getBishopMoves(r, c, moves)
-        self.getRookMoves(r, c, moves)
+        allyColor = "w" if self.whiteToMove else "b"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        targets = queenAttacks(r * 8 + c, occupied) & ~self.colorBitboards[allyColor]
+        self.addMoves(r, c, targets, moves)
 
     def getKingMoves(self, r, c, moves):
         """
         Get all the king moves for the king located at row, col and add moves to the list
         """
-        king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, 1),
-                      (1, 1), (1, 0), (1, -1), (0, -1))
         allyColor = "w" if self.whiteToMove else "b"
-
-        for move in king_moves:
-            endRow = r + move[0]
-            endCol = c + move[1]
-
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        targets = KING_ATTACKS[r * 8 + c] & ~self.colorBitboards[allyColor]
+        self.addMoves(r, c, targets, moves)
 
     def updateCastleRights(self, move):
         """
@@ -378,11 +723,17 @@ class GameState:
                 elif move.startCol == 7:  # left rook
                     self.currentCastlingRight.bks = False
 
+        # a rook captured on its starting square can't castle any more
         if move.pieceCaptured == 'wR':
             if move.endRow == 7:
                 if move.endCol == 0:
                     self.currentCastlingRight.wqs = False
-                    self.currentCastlingRight.qks = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.wks = False
+        elif move.pieceCaptured == 'bR':
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRight.bqs = False
                 elif move.endCol == 7:
                     self.currentCastlingRight.bks = False
 
@@ -401,15 +752,15 @@ class GameState:
 
     def getKingSideCastleMoves(self, r, c, moves):
         if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
-            if not self.squareUnderAttack(r, c + 1) and not self.squareUnderAttack(r, c + 2):
+            if not self.squaresUnderAttack(((r, c + 1), (r, c + 2))):
                 moves.append(
-                    Move((r, c), (r, c + 2), self.board, isCastleMove=True))
+                    self.getMove((r, c), (r, c + 2), isCastleMove=True))
 
     def getQueenSideCastleMoves(self, r, c, moves):
         if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
-            if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
+            if not self.squaresUnderAttack(((r, c - 1), (r, c - 2))):
                 moves.append(
-                    Move((r, c), (r, c - 2), self.board, isCastleMove=True))
+                    self.getMove((r, c), (r, c - 2), isCastleMove=True))
 
 
 class CastleRights:
@@ -420,12 +771,30 @@ class CastleRights:
         self.bqs = bqs
 
 
+# small integer per piece, used to build the keys of MOVE_CACHE
+PIECE_CODES = {"--": 0, "wp": 1, "wR": 2, "wN": 3, "wB": 4, "wQ": 5, "wK": 6,
+               "bp": 7, "bR": 8, "bN": 9, "bB": 10, "bQ": 11, "bK": 12}
+ENPASSANT_FLAG = 1
+CASTLE_FLAG = 2
+PROMOTION_FLAG = 4
+
+# Moves never change after they are built, so the generators share one instance per distinct move,
+# keyed by squares, flags and the pieces moved and captured
+MOVE_CACHE = {}
+
+
 class Move:
     """
     In chess, fields on the board are described by two symbols, one of them being number between 1-8 (which is corresponding to rows)
     and the second one being a letter between a-f (corresponding to columns), in order to use this notation we need to map our [row][col] coordinates
     to match the ones used in the original chess game
+
+    A move is packed into code: start square (bits 0-5), end square (bits 6-11) and flags (bits 12-14,
+    en passant, castle, promotion to queen). Rows and columns are read from it on demand
     """
+    __slots__ = ("code", "startSq", "endSq", "moveID", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "isEnpassantMove", "isCastleMove", "isCapture")
+
     ranksToRows = {"1": 7, "2": 6, "3": 5,
                    "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
@@ -434,22 +803,39 @@ class Move:
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
     def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * \
-            100 + self.endRow * 10 + self.endCol
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (
-            self.pieceMoved == 'bp' and self.endRow == 7)
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startSq = startRow * 8 + startCol  # square indices used by the bitboards
+        self.endSq = endRow * 8 + endCol
+        self.moveID = self.startSq | self.endSq << 6
+        self.pieceMoved = board[startRow][startCol]
+        self.pieceCaptured = board[endRow][endCol]
+        self.isPawnPromotion = (self.pieceMoved == 'wp' and endRow == 0) or (
+            self.pieceMoved == 'bp' and endRow == 7)
         self.isEnpassantMove = isEnpassantMove
         self.isCastleMove = isCastleMove
 
         if self.isEnpassantMove:
             self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
         self.isCapture = self.pieceCaptured != "--"
+        self.code = self.moveID | (isEnpassantMove * ENPASSANT_FLAG | isCastleMove * CASTLE_FLAG
+                                   | self.isPawnPromotion * PROMOTION_FLAG) << 12
+
+    @property
+    def startRow(self):
+        return self.startSq >> 3
+
+    @property
+    def startCol(self):
+        return self.startSq & 7
+
+    @property
+    def endRow(self):
+        return self.endSq >> 3
+
+    @property
+    def endCol(self):
+        return self.endSq & 7
 
     def __eq__(self, other):
         """
@@ -458,6 +844,9 @@ class Move:
         if isinstance(other, Move):
             return self.moveID == other.moveID
 
+    def __hash__(self):
+        return self.moveID
+
     def __str__(self):
         """
         Overriding the string function
@@ -0,0 +1,100 @@
+"""
+Evaluation tables shared by the search and by GameState, which keeps a running total of them.
+Scores are kept as whole tenths of a pawn, so the running total never drifts from a full scan of the board.
+"""
+
+PIECE_SCORE = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
+
+KNIGHT_SCORES = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.6, 0.6, 0.6, 0.5, 0.2],
+                 [0.2, 0.5, 0.6, 0.7, 0.7, 0.6, 0.5, 0.2],
+                 [0.2, 0.5, 0.6, 0.7, 0.7, 0.6, 0.5, 0.2],
+                 [0.2, 0.5, 0.6, 0.6, 0.6, 0.6, 0.5, 0.2],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+BISHOP_SCORES = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+ROOK_SCORES = [[0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2],
+               [0.5, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.5],
+               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+               [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+               [0.2, 0.2, 0.2, 0.5, 0.5, 0.2, 0.2, 0.2]]
+
+QUEEN_SCORES = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+PAWN_SCORES = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.2, 0.2, 0.3, 0.4, 0.4, 0.3, 0.2, 0.2],
+               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
+               [0.2, 0.1, 0.1, 0.2, 0.2, 0.1, 0.1, 0.2],
+               [0.2, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.2],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+PIECE_POSITION_SCORES = {
+    "wp": PAWN_SCORES,
+    "bp": PAWN_SCORES[::-1],
+    "wN": KNIGHT_SCORES,
+    "bN": KNIGHT_SCORES[::-1],
+    "wB": BISHOP_SCORES,
+    "bB": BISHOP_SCORES[::-1],
+    "wR": ROOK_SCORES,
+    "bR": ROOK_SCORES[::-1],
+    "wQ": QUEEN_SCORES,
+    "bQ": QUEEN_SCORES[::-1]
+}
+
+SCORE_SCALE = 10  # score units per pawn
+
+
+def _pieceSquareValues():
+    """
+    Material plus position score of every piece on every square in score units,
+    positive for white pieces and negative for black ones
+    """
+    values = {}
+    for piece in ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK'):
+        sign = 1 if piece[0] == 'w' else -1
+        squareValues = []
+        for row in range(8):
+            for col in range(8):
+                positionScore = PIECE_POSITION_SCORES[piece][row][col] if piece[1] != "K" else 0
+                squareValues.append(sign * round((PIECE_SCORE[piece[1]] + positionScore) * SCORE_SCALE))
+        values[piece] = squareValues
+    return values
+
+
+PIECE_SQUARE_VALUES = _pieceSquareValues()
+PIECE_VALUES = {piece: score * SCORE_SCALE for piece, score in PIECE_SCORE.items()}
+
+
+def scanBoard(board):
+    """
+    Full scan of the board, a positive score is good for white, a negative score is good for black
+    """
+    score = 0
+    for row in range(len(board)):
+        for col in range(len(board[row])):
+            piece = board[row][col]
+            if piece != "--":
+                score += PIECE_SQUARE_VALUES[piece][row * 8 + col]
+    return score
@@ -0,0 +1,161 @@
+"""
+Load generator for server.py.
+Every client opens its own connection and plays games against the engine, one after another, until
+--games games have been played: a random legal move for the client, an engine move with --movetime
+for the server, up to --max-plies plies a game. An engine request the server is too busy for is
+sent again after a short wait. Reports the latency of each kind of request
+(p50, p99 and the slowest, an engine move is timed from its first try to its answer),
+requests turned away, and games per second.
+
+    python server.py --port 8765 --processes 4 &
+    python loadgen.py --port 8765 --clients 16 --games 64 --movetime 0.1
+
+With --start the server is started for the run and stopped afterwards:
+
+    python loadgen.py --start 4 --clients 16 --games 64
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from server import DEFAULT_PORT
+
+BUSY_RETRY = 0.05  # seconds a client waits before it asks again for an engine move the server was too busy for
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Client:
+    def __init__(self, reader, writer, latencies):
+        self.reader = reader
+        self.writer = writer
+        self.latencies = latencies  # op: [seconds]
+        self.failures = {}  # error message: count
+
+    async def request(self, op, timed=True, **fields):
+        """
+        Send one request and wait for its answer
+        """
+        start = time.perf_counter()
+        self.writer.write(json.dumps(dict(fields, op=op)).encode() + b"\n")
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        if timed:
+            self.latencies.setdefault(op, []).append(time.perf_counter() - start)
+        reply = json.loads(line)
+        if not reply["ok"]:
+            self.failures[reply["error"]] = self.failures.get(reply["error"], 0) + 1
+        return reply
+
+    async def playGame(self, moveTime, maxPlies):
+        """
+        Returns True if the game was played to its end or to maxPlies
+        """
+        state = await self.request("new")
+        if not state["ok"]:
+            return False
+        game = state["game"]
+        try:
+            for ply in range(maxPlies):
+                if state["status"] != "playing":
+                    break
+                if ply % 2 == 0:
+                    state = await self.request("move", game=game, move=random.choice(state["legalMoves"]))
+                else:
+                    start = time.perf_counter()
+                    state = await self.request("engine", False, game=game, movetime=moveTime)
+                    while not state["ok"] and state["error"] == "server busy":
+                        await asyncio.sleep(BUSY_RETRY)
+                        state = await self.request("engine", False, game=game, movetime=moveTime)
+                    self.latencies.setdefault("engine", []).append(time.perf_counter() - start)
+                if not state["ok"]:
+                    return False
+            return True
+        finally:
+            await self.request("close", game=game)
+
+
+async def runClients(host, port, clients, games, moveTime, maxPlies):
+    """
+    (latencies by op, failures by error, games played, seconds taken)
+    """
+    latencies = {}
+    failures = {}
+    remaining = [games]
+    played = [0]
+
+    async def runClient():
+        reader, writer = await asyncio.open_connection(host, port)
+        client = Client(reader, writer, latencies)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                finished = await client.playGame(moveTime, maxPlies)
+                played[0] += finished
+        finally:
+            writer.close()
+            for error, count in client.failures.items():
+                failures[error] = failures.get(error, 0) + count
+
+    start = time.perf_counter()
+    await asyncio.gather(*(runClient() for _ in range(clients)))
+    return latencies, failures, played[0], time.perf_counter() - start
+
+
+def startServer(port, processes):
+    """
+    Start server.py and wait until it accepts clients
+    """
+    server = subprocess.Popen([sys.executable, "server.py", "--port", str(port), "--processes", str(processes)],
+                              stdout=subprocess.PIPE, text=True)
+    if not server.stdout.readline():  # "serving on ..."
+        raise SystemExit("server.py did not start")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=8, help="connections playing at the same time")
+    parser.add_argument("--games", type=int, default=32, help="games to play in all")
+    parser.add_argument("--movetime", type=float, default=0.1, help="seconds per engine move (default 0.1)")
+    parser.add_argument("--max-plies", type=int, default=40, help="plies played per game")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the client moves")
+    parser.add_argument("--start", type=int, metavar="PROCESSES", help="start server.py with this many processes")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    server = startServer(args.port, args.start) if args.start else None
+    try:
+        latencies, failures, played, elapsed = asyncio.run(
+            runClients(args.host, args.port, args.clients, args.games, args.movetime, args.max_plies))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print("%-8s %8s %10s %10s %10s" % ("request", "count", "p50 ms", "p99 ms", "max ms"))
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        print("%-8s %8d %10.1f %10.1f %10.1f" % (op, len(values), percentile(values, 0.5) * 1000,
+                                                 percentile(values, 0.99) * 1000, values[-1] * 1000))
+    for error, count in sorted(failures.items()):
+        print("failed: %s x%d" % (error, count))
+    print("%d games in %.1fs with %d clients: %.2f games/s" % (played, elapsed, args.clients, played / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,38 @@
 """
 This is the main driver file. 
-It is responsible for handling user input and displaying the current game state
+It is responsible for handling user input and displaying the current game state.
+pygame is only imported once main() runs: with the spawn start method (Windows, macOS) every search process
+imports this module again, and the GUI stack would be loaded into each of them for nothing.
+The engine modules (engine.py, ai.py, worker.py, ...) never import it.
 """
 
 
-import pygame as p
+import os
 from engine import GameState, Move
-from ai import findBestMove, findRandomMove
-from multiprocessing import Process, Queue
+from ai import findRandomMove
+from worker import SearchWorker
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 250
 MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8  # Dimensions of a chess board are 8x8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
-MAX_FPS = 15  # Mainly for animations
+ANIMATION_FPS = 60
+MOVE_LOG_PADDING = 5
+MOVE_LOG_LINE_SPACING = 2
+MOVES_PER_LINE = 2  # full moves (white and black) on one line of the move log
+AI_POLL_INTERVAL = 50  # milliseconds between two looks for the AI's answer, otherwise the loop sleeps until input
+AI_MOVE_TIME = 1.0  # seconds the AI may think per move
+AI_THREADS = 1  # processes searching each AI move, more than one runs a parallel search (see smp.py)
+SHOW_AI_STATS = True  # print what every AI search did to the console
+AI_BOOK = "book.bin"  # opening book of the AI, built with book.py, not used if the file doesn't exist
+AI_TABLEBASE = "tables"  # endgame tables of the AI, built with tablebase.py, not used if missing
+AI_PONDER = True  # let the AI search on the human's time, on the reply it expects
 IMAGES = {}
-COLORS = [p.Color("white"), p.Color("gray")]
+SOUNDS = {}
+COLORS = ["white", "gray"]
+BOARD_SURFACE = None  # all 64 squares rendered once by loadImages, drawn from instead of square by square
+p = None  # the pygame module, imported by main()
 
 
 def loadImages():
@@ -31,18 +47,179 @@ def loadImages():
         IMAGES[piece] = p.transform.scale(p.image.load(
             "assets/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
 
+    global BOARD_SURFACE
+    BOARD_SURFACE = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            p.draw.rect(BOARD_SURFACE, p.Color(COLORS[((r + c) % 2)]),
+                        p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+
+
+def loadSounds():
+    """
+    Initialize global dictionary of sounds, once like the images, so a move doesn't read a file.
+    Without a working audio device the game goes on silently
+    """
+    try:
+        p.mixer.init()
+        for name in ("move", "capture"):
+            SOUNDS[name] = p.mixer.Sound("audio/" + name + ".mp3")
+    except (p.error, FileNotFoundError) as error:
+        SOUNDS.clear()
+        print("no sound:", error)
+
+
+def playSound(name):
+    sound = SOUNDS.get(name)
+    if sound is not None:
+        sound.play()
+
+
+class MoveLogPanel:
+    def __init__(self, font):
+        """
+        The move log on the right side of the window. Every line is rendered to a surface once and kept,
+        a move or an undo only renders the last line again. Only the lines that fit in the panel are drawn,
+        the mouse wheel scrolls through the others. It follows the latest move unless scrolled back
+        """
+        self.font = font
+        self.rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
+        self.lineHeight = font.get_height() + MOVE_LOG_LINE_SPACING
+        self.visibleLines = max(1, (self.rect.height - MOVE_LOG_PADDING) // self.lineHeight)
+        self.moves = []  # the move log the lines were rendered from
+        self.lines = []  # one rendered surface per line
+        self.firstLine = 0  # first line shown
+        self.dirty = True  # the panel on screen is out of date
+
+    def update(self, moveLog):
+        """
+        Bring the lines in step with the move log, rendering only those from the first changed move on
+        """
+        if self.moves == moveLog:
+            return
+        following = self.firstLine >= self.getLastFirstLine()
+        changed = 0
+        while changed < min(len(self.moves), len(moveLog)) and self.moves[changed] is moveLog[changed]:
+            changed += 1
+        self.moves = list(moveLog)
+        pliesPerLine = 2 * MOVES_PER_LINE
+        del self.lines[changed // pliesPerLine:]
+        for i in range(len(self.lines), (len(moveLog) + pliesPerLine - 1) // pliesPerLine):
+            self.lines.append(self.font.render(self.getLineText(i), True, p.Color('White')))
+        self.firstLine = self.getLastFirstLine() if following else min(self.firstLine, self.getLastFirstLine())
+        self.dirty = True
+
+    def getLineText(self, line):
+        text = ""
+        for i in range(line * 2 * MOVES_PER_LINE, min((line + 1) * 2 * MOVES_PER_LINE, len(self.moves)), 2):
+            text += str(i // 2 + 1) + ". " + str(self.moves[i]) + " "
+            if i + 1 < len(self.moves):  # append opponent move
+                text += str(self.moves[i + 1]) + "  "
+        return text
+
+    def getLastFirstLine(self):
+        return max(0, len(self.lines) - self.visibleLines)
+
+    def scroll(self, lines):
+        firstLine = max(0, min(self.firstLine + lines, self.getLastFirstLine()))
+        if firstLine != self.firstLine:
+            self.firstLine = firstLine
+            self.dirty = True
+
+    def draw(self, screen):
+        """
+        Draws the visible lines, returns the rectangle of the panel
+        """
+        p.draw.rect(screen, p.Color("dark gray"), self.rect)
+        textY = MOVE_LOG_PADDING
+        for surface in self.lines[self.firstLine:self.firstLine + self.visibleLines]:
+            screen.blit(surface, self.rect.move(MOVE_LOG_PADDING, textY))
+            textY += self.lineHeight
+        self.dirty = False
+        return self.rect
+
+
+class Renderer:
+    def __init__(self, screen, moveLogFont):
+        """
+        Draws the game with dirty rectangles. It remembers what every square shows (piece and highlight)
+        and whether the move log and end of game text are up to date, draw only paints what changed since
+        and returns those rectangles for display.update
+        """
+        self.screen = screen
+        self.moveLogPanel = MoveLogPanel(moveLogFont)
+        self.highlightSurfaces = {}
+        for color in ("blue", "yellow"):
+            surface = p.Surface((SQ_SIZE, SQ_SIZE))
+            surface.set_alpha(100)
+            surface.fill(p.Color(color))
+            self.highlightSurfaces[color] = surface
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget what is on screen, the next draw paints everything (first frame, window uncovered)
+        """
+        self.squares = [None] * (DIMENSION * DIMENSION)
+        self.moveLogPanel.dirty = True
+        self.endText = None
+
+    def invalidateArea(self, area):
+        """
+        Something else (an animation) has drawn over area, repaint the squares it touches
+        """
+        for r in range(area.top // SQ_SIZE, min((area.bottom - 1) // SQ_SIZE + 1, DIMENSION)):
+            for c in range(area.left // SQ_SIZE, min((area.right - 1) // SQ_SIZE + 1, DIMENSION)):
+                self.squares[r * DIMENSION + c] = None
+
+    def draw(self, gs, validMoves, sqSelected, endText=None):
+        rects = []
+        if self.endText is not None and endText != self.endText:
+            self.squares = [None] * (DIMENSION * DIMENSION)  # the old text covers squares that didn't change
+        highlights = getHighlights(gs, validMoves, sqSelected)
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                square = (gs.board[r][c], highlights.get((r, c)))
+                if square != self.squares[r * DIMENSION + c]:
+                    self.squares[r * DIMENSION + c] = square
+                    rects.append(self.drawSquare(r, c, square[0], square[1]))
+
+        self.moveLogPanel.update(gs.moveLog)
+        if self.moveLogPanel.dirty:
+            rects.append(self.moveLogPanel.draw(self.screen))
+
+        # the text lies over the squares, put it back over any of them that was painted
+        if endText is not None and (rects or endText != self.endText):
+            rects.append(drawEndGameText(self.screen, endText))
+        self.endText = endText
+        return rects
+
+    def drawSquare(self, r, c, piece, highlight):
+        rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(BOARD_SURFACE, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlightSurfaces[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
 
 def main():
     """
     The main driver for the code. 
     It will handle user input and updating the graphics
     """
+    # started first, so a forked search process doesn't inherit pygame either
+    moveWorker = SearchWorker(AI_THREADS, AI_BOOK if os.path.exists(AI_BOOK) else None,
+                              AI_TABLEBASE if os.path.isdir(AI_TABLEBASE) else None)  # searches in the background and keeps its tables between moves
+    global p
+    import pygame as p
     p.init()
     p.display.set_caption('[Chess Engine] by vonderklaas')
-    p.mixer.init()
     screen = p.display.set_mode(
         [BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT])
     clock = p.time.Clock()
+    p.event.set_blocked(p.MOUSEMOTION)  # not used, it would only wake the loop
     moveLogFont = p.font.SysFont("Arial", 14, False, False)
     gs = GameState()
     validMoves = gs.getValidMoves()
@@ -51,8 +228,6 @@ def main():
     playerClicks = []
     playerOne = True  # If true, human is playing white, otherwise AI is playing white
     playerTwo = False  # same as above, except playing black
-    moveFinderProcess = None
-    returnQueue = None
     AIThinking = False
     gameOver = False
     moveMade = False
@@ -61,16 +236,26 @@ def main():
     running = True
 
     loadImages()
+    loadSounds()
+    renderer = Renderer(screen, moveLogFont)
+    events = []
 
     while running:
         isHumanTurn = (gs.whiteToMove and playerOne) or (
             not gs.whiteToMove and playerTwo)
 
-        for e in p.event.get():
+        for e in events + p.event.get():
             if e.type == p.QUIT:
                 running = False
 
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type in (p.WINDOWEXPOSED, p.VIDEOEXPOSE):
+                renderer.invalidate()
+
+            elif e.type == p.MOUSEWHEEL:
+                if renderer.moveLogPanel.rect.collidepoint(p.mouse.get_pos()):
+                    renderer.moveLogPanel.scroll(-e.y)
+
+            elif e.type == p.MOUSEBUTTONDOWN and e.button < 4:  # 4 and 5 are the wheel, see MOUSEWHEEL
                 if not gameOver:
                     location = p.mouse.get_pos()
                     col = location[0] // SQ_SIZE
@@ -90,6 +275,8 @@ def main():
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
                                 gs.makeMove(validMoves[i])
+                                # on a ponder hit the search of the reply is already running
+                                AIThinking = moveWorker.makeMove(validMoves[i])
                                 moveMade = True
                                 animate = True
                                 sqSelected = ()
@@ -99,75 +286,91 @@ def main():
 
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_u:
+                    if AIThinking:
+                        moveWorker.stop()
+                        AIThinking = False
                     gs.undoMove()
+                    moveWorker.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
                     moveUndone = True
                 if e.key == p.K_r:
+                    if AIThinking:
+                        moveWorker.stop()
+                        AIThinking = False
                     gs = GameState()
+                    moveWorker.setPosition()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
                     gameOver = False
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
                     moveUndone = True
 
         if not gameOver and not isHumanTurn and not moveUndone:
             if not AIThinking:
                 AIThinking = True
-                returnQueue = Queue()  # used to pass data between threads
-                moveFinderProcess = Process(
-                    target=findBestMove, args=(gs, validMoves, returnQueue))
-                moveFinderProcess.start()
+                moveWorker.go(moveTime=AI_MOVE_TIME)
 
-            if not moveFinderProcess.is_alive():
-                AIMove = returnQueue.get()
+            done, notation, stats = moveWorker.getResult()
+            if done:
+                if SHOW_AI_STATS and stats is not None:
+                    print(stats)
+                AIMove = gs.getMoveFromNotation(notation) if notation is not None else None
                 if AIMove is None:
                     AIMove = findRandomMove(validMoves)
 
                 gs.makeMove(AIMove)
+                moveWorker.makeMove(AIMove)
                 moveMade = True
                 animate = True
                 AIThinking = False
 
+                humanToMove = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+                if AI_PONDER and humanToMove:
+                    # the reply the search expects, without one ponder on every reply
+                    pv = stats.iterations[-1]["pv"] if stats is not None and stats.iterations else []
+                    expected = pv[1] if len(pv) > 1 and pv[0] == AIMove.getChessNotation() else None
+                    moveWorker.ponder(expected, AI_MOVE_TIME)
+
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                renderer.invalidateArea(animateMove(gs.moveLog[-1], screen, gs.board, clock))
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
             moveUndone = False
 
-        drawGameState(screen, gs, validMoves, sqSelected, moveLogFont)
-
+        text = None
         if gs.checkmate or gs.stalemate:
             gameOver = True
+            if AIThinking:
+                # a ponder hit on the move that ended the game, there is nothing left to search
+                moveWorker.stop()
+                AIThinking = False
             if gs.stalemate:
                 text = "Stalemate."
             else:
                 text = "Black wins by checkmate!" if gs.whiteToMove else "White wins by checkmate!"
-            drawEndGameText(screen, text)
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
 
+        rects = renderer.draw(gs, validMoves, sqSelected, text)
+        if rects:
+            p.display.update(rects)
+
+        # sleep until there is input, or until it is time to look for the AI's answer again
+        if running:
+            isHumanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+            if AIThinking:
+                e = p.event.wait(AI_POLL_INTERVAL)
+            elif isHumanTurn or gameOver:
+                e = p.event.wait()
+            else:
+                e = p.event.poll()  # the AI is about to start thinking
+            events = [e] if e.type != p.NOEVENT else []
 
-def drawGameState(screen, gs, validMoves, sqSelected, moveLogFont):
-    """
-    Responsible for all the graphics within a current game state
-    """
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
-    drawMoveLog(screen, gs, moveLogFont)
+    moveWorker.quit()
 
 
 def drawBoard(screen):
@@ -175,33 +378,22 @@ def drawBoard(screen):
     Draws the squares on the board.
     In chess, the top left square is always light.
     """
-    global COLORS
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = COLORS[((r + c) % 2)]
-            p.draw.rect(screen, color, p.Rect(
-                c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    screen.blit(BOARD_SURFACE, (0, 0))
 
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def getHighlights(gs, validMoves, sqSelected):
     """
-    Highlight square selection
+    Highlight square selection: {(row, col): color} of the selected square and the moves from it
     """
+    highlights = {}
     if sqSelected != ():
         r, c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            # highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-
-            # highlight valid moves from that square
-            s.fill(p.Color('yellow'))
+            highlights[(r, c)] = "blue"
             for move in validMoves:
                 if move.startRow == r and move.startCol == c:
-                    screen.blit(
-                        s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+                    highlights[(move.endRow, move.endCol)] = "yellow"
+    return highlights
 
 
 def drawPieces(screen, board):
@@ -217,53 +409,20 @@ def drawPieces(screen, board):
                     c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
 
-def drawMoveLog(screen, gs, font):
-    """
-    Draws the move log on the right side of the window
-    """
-    moveLogRect = p.Rect(
-        BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color("dark gray"), moveLogRect)
-    moveLog = gs.moveLog
-    moveTexts = []
-    for i in range(0, len(moveLog), 2):
-        moveString = str(i // 2 + 1) + ". " + str(moveLog[i]) + " "
-        if i + 1 < len(moveLog):  # append opponent move
-            moveString += str(moveLog[i + 1]) + "  "
-        moveTexts.append(moveString)
-
-    movesPerRow = 2
-    padding = 5
-    lineSpacing = 2
-    textY = padding
-
-    for i in range(0, len(moveTexts), movesPerRow):
-        text = ""
-        for j in range(movesPerRow):
-            if i + j < len(moveTexts):
-                text += moveTexts[i + j]
-
-        textObject = font.render(text, True, p.Color('White'))
-        textLocation = moveLogRect.move(padding, textY)
-        screen.blit(textObject, textLocation)
-        textY += textObject.get_height() + lineSpacing
-
-
 def animateMove(move, screen, board, clock):
     """
-    Animating a move including playing the sound
+    Animating a move including playing the sound.
+    Only the squares between the start and end square are drawn and updated, that area is returned
     """
-    if move.isCapture:
-        p.mixer.music.load("audio/capture.mp3")
-        p.mixer.music.play()
-    else:
-        p.mixer.music.load("audio/move.mp3")
-        p.mixer.music.play()
+    playSound("capture" if move.isCapture else "move")
 
     dR = move.endRow - move.startRow
     dC = move.endCol - move.startCol
     framesPerSquare = 7
     frameCount = (abs(dR) + abs(dC)) * framesPerSquare
+    area = p.Rect(min(move.startCol, move.endCol) * SQ_SIZE, min(move.startRow, move.endRow) * SQ_SIZE,
+                  (abs(dC) + 1) * SQ_SIZE, (abs(dR) + 1) * SQ_SIZE)
+    screen.set_clip(area)
 
     for frame in range(frameCount + 1):
         r, c = (move.startRow + dR * frame / frameCount,
@@ -272,10 +431,9 @@ def animateMove(move, screen, board, clock):
         drawPieces(screen, board)
 
         # erase the piece moved from its ending square
-        color = COLORS[(move.endRow + move.endCol) % 2]
         endSquare = p.Rect(move.endCol * SQ_SIZE,
                            move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
+        screen.blit(BOARD_SURFACE, endSquare, endSquare)
 
         # draw captured piece onto rectangle
         if move.pieceCaptured != '--':
@@ -289,13 +447,15 @@ def animateMove(move, screen, board, clock):
             screen.blit(IMAGES[move.pieceMoved], p.Rect(
                 c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-        p.display.flip()
-        clock.tick(60)
+        p.display.update(area)
+        clock.tick(ANIMATION_FPS)
+    screen.set_clip(None)
+    return area
 
 
 def drawEndGameText(screen, text):
     """
-    Draw text on screen
+    Draw text on screen, returns the rectangle it covers
     """
     # Draw text shadow
     font = p.font.SysFont("Helvetica", 32, True, False)
@@ -307,6 +467,7 @@ def drawEndGameText(screen, text):
     # Draw main text
     textObject = font.render(text, False, p.Color("Black"))
     screen.blit(textObject, textLocation.move(2, 2))
+    return p.Rect(textLocation.topleft, (textObject.get_width() + 2, textObject.get_height() + 2))
 
 
 if __name__ == "__main__":
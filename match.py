@@ -0,0 +1,94 @@
+"""
+Self-play match between the search with an ai.py switch on and with it off, to measure what a search
+feature is worth in play rather than in nodes (see bench.py for that), e.g.
+
+    python match.py --compare NULL_MOVE --movetime 0.2
+    python match.py --compare LATE_MOVE_REDUCTIONS --depth 4
+
+Each side keeps its own transposition table and history. Every opening line of bench.py is played twice,
+with colors swapped, and the result is counted from the side with the switch on.
+A game is drawn by stalemate, threefold repetition, the fifty move rule, insufficient material
+or when it reaches --max-plies.
+"""
+
+import argparse
+
+import ai
+from bench import POSITIONS, playLine
+from tablebase import isInsufficientMaterial
+from transposition import TranspositionTable
+
+
+class Player:
+    def __init__(self, flag, setting):
+        self.flag = flag
+        self.setting = setting
+        self.transpositionTable = TranspositionTable()
+        self.historyTable = [0] * len(ai.historyTable)
+        self.nodes = 0
+
+    def findMove(self, gs, validMoves, depth, moveTime):
+        """
+        Search with this player's switch and tables
+        """
+        setattr(ai, self.flag, self.setting)
+        ai.transpositionTable, ai.historyTable = self.transpositionTable, self.historyTable
+        move, stats = ai.findBestMove(gs, validMoves, None, moveTime=moveTime, maxDepth=depth)
+        self.nodes += stats.nodes
+        return move
+
+
+def playGame(line, white, black, depth, moveTime, maxPlies):
+    """
+    Play one game from the opening line, returns (1, 0.5 or 0 for white, how it ended, plies played)
+    """
+    gs = playLine(line)
+    seen = {}
+    while len(gs.moveLog) < maxPlies:
+        validMoves = gs.getValidMoves()
+        if gs.checkmate:
+            return (0 if gs.whiteToMove else 1), "checkmate", len(gs.moveLog)
+        if gs.stalemate:
+            return 0.5, "stalemate", len(gs.moveLog)
+        seen[gs.zobristKey] = seen.get(gs.zobristKey, 0) + 1
+        if seen[gs.zobristKey] >= 3:
+            return 0.5, "repetition", len(gs.moveLog)
+        if int(gs.getFen().split()[4]) >= 100:
+            return 0.5, "fifty moves", len(gs.moveLog)
+        if isInsufficientMaterial([piece for row in gs.board for piece in row if piece != "--"]):
+            return 0.5, "insufficient material", len(gs.moveLog)
+        player = white if gs.whiteToMove else black
+        gs.makeMove(player.findMove(gs, validMoves, depth, moveTime))
+    return 0.5, "move limit", len(gs.moveLog)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", metavar="FLAG", required=True, help="ai.py switch to play on against off")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--depth", type=int, help="plies searched per move")
+    limit.add_argument("--movetime", type=float, default=0.2, help="seconds per move (default 0.2)")
+    parser.add_argument("--max-plies", type=int, default=200, help="a game this long is a draw")
+    args = parser.parse_args()
+    if not isinstance(getattr(ai, args.compare, None), bool):
+        parser.error("ai.%s is not a search switch" % args.compare)
+    moveTime = args.movetime if args.depth is None else None
+
+    on, off = Player(args.compare, True), Player(args.compare, False)
+    wins = draws = losses = 0
+    for name, line in POSITIONS.items():
+        for white, black in ((on, off), (off, on)):
+            result, reason, plies = playGame(line, white, black, args.depth, moveTime, args.max_plies)
+            score = result if white is on else 1 - result
+            wins += score == 1
+            draws += score == 0.5
+            losses += score == 0
+            print("%-14s %s=%-5s as white: %-7s %s after %d plies"
+                  % (name, args.compare, white is on, {1: "1-0", 0.5: "1/2-1/2", 0: "0-1"}[result], reason, plies))
+    games = wins + draws + losses
+    print("%s on against off: +%d =%d -%d, %.1f%% of the points, nodes %d against %d"
+          % (args.compare, wins, draws, losses, 100 * (wins + draws / 2) / games, on.nodes, off.nodes))
+
+
+if __name__ == "__main__":
+    main()
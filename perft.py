@@ -0,0 +1,160 @@
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+The counts of well known positions are published, so any difference points at a bug in move generation
+or in makeMove / undoMove, which are played here exactly as the search plays them.
+
+    python perft.py --position kiwipete --depth 3
+    python perft.py --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1" --depth 4 --divide
+    python perft.py --suite --json
+
+--suite checks every position of SUITE against its published counts and exits with status 1 on a mismatch.
+Pawns only ever promote to a queen in this engine, so only depths where no promotion can happen are listed:
+published counts include all four promotions.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from engine import GameState, START_FEN
+from evaluation import scanBoard
+from zobrist import computeKey
+
+# name: (FEN, {depth: published node count})
+SUITE = {
+    "start": (START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 {1: 48, 2: 2039, 3: 97862}),
+    "position 3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                   {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    "position 6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   {1: 46, 2: 2079, 3: 89890}),
+    "short castling gives check": ("5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    "long castling gives check": ("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    "castle rights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    "castling prevented": ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    "stalemate and checkmate": ("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+}
+
+
+def perft(gs, depth, check=False):
+    """
+    Number of leaf nodes depth plies below the position. The last ply is counted, not played (bulk counting).
+    With check, the incrementally kept hash key and score are compared to a full recomputation at every node
+    """
+    if check:
+        checkState(gs)
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, check)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth, check=False):
+    """
+    Leaf count below each root move, keyed by its coordinate notation
+    """
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1, check) if depth > 1 else 1
+        gs.undoMove()
+    return counts
+
+
+def checkState(gs):
+    if gs.zobristKey != computeKey(gs):
+        raise AssertionError("zobrist key out of step after %s" % [str(move) for move in gs.moveLog])
+    if gs.materialScore != scanBoard(gs.board):
+        raise AssertionError("material score out of step after %s" % [str(move) for move in gs.moveLog])
+
+
+def run(name, fen, depth, showDivide=False, check=False, expected=None):
+    """
+    Perft of one position, returns the result as a dictionary
+    """
+    gs = GameState(fen)
+    start = time.perf_counter()
+    if showDivide:
+        counts = divide(gs, depth, check)
+        nodes = sum(counts.values())
+    else:
+        counts = None
+        nodes = perft(gs, depth, check)
+    seconds = time.perf_counter() - start
+    if gs.getFen() != GameState(fen).getFen():
+        raise AssertionError("position not restored after perft of " + fen)
+    result = {
+        "name": name,
+        "fen": fen,
+        "depth": depth,
+        "nodes": nodes,
+        "seconds": round(seconds, 3),
+        "nps": round(nodes / seconds) if seconds else 0
+    }
+    if counts is not None:
+        result["divide"] = counts
+    if expected is not None:
+        result["expected"] = expected
+        result["ok"] = nodes == expected
+    return result
+
+
+def printResult(result):
+    for notation, count in result.get("divide", {}).items():
+        print("%s: %d" % (notation, count))
+    line = "%-28s depth %d %10d nodes %8.2fs %9d nps" % (result["name"], result["depth"], result["nodes"],
+                                                         result["seconds"], result["nps"])
+    if "expected" in result:
+        line += "  ok" if result["ok"] else "  FAILED, expected %d" % result["expected"]
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--fen", help="position to count, the initial position by default")
+    source.add_argument("--position", choices=SUITE.keys(), help="position of the suite")
+    source.add_argument("--suite", action="store_true", help="check every suite position against its counts")
+    parser.add_argument("--depth", type=int, help="plies to count, with --suite the deepest depth to check")
+    parser.add_argument("--divide", action="store_true", help="also count below each root move")
+    parser.add_argument("--check", action="store_true", help="verify the incremental hash key and score (slow)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines")
+    args = parser.parse_args()
+
+    jobs = []
+    if args.suite:
+        for name, (fen, counts) in SUITE.items():
+            depths = [depth for depth in counts if args.depth is None or depth <= args.depth]
+            if depths:
+                jobs.append((name, fen, max(depths), counts[max(depths)]))
+    else:
+        depth = args.depth if args.depth is not None else 3
+        if args.fen:
+            jobs.append(("fen", args.fen, depth, None))
+        else:
+            name = args.position or "start"
+            fen, counts = SUITE[name]
+            jobs.append((name, fen, depth, counts.get(depth)))
+    if any(depth < 1 for name, fen, depth, expected in jobs):
+        parser.error("depth must be at least 1")
+
+    failed = False
+    for name, fen, depth, expected in jobs:
+        result = run(name, fen, depth, args.divide, args.check, expected)
+        failed = failed or result.get("ok") is False
+        if args.json:
+            print(json.dumps(result))
+        else:
+            printResult(result)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
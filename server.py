@@ -0,0 +1,285 @@
+"""
+Game server: hosts many games at once for network clients, without a display.
+Clients connect over TCP and send one JSON object per line, every request is answered with one JSON line:
+
+    {"op": "new"}                                  -> {"ok": true, "game": "...", "fen": "...", "legalMoves": [...]}
+    {"op": "new", "fen": "<FEN>"}
+    {"op": "move", "game": "...", "move": "e2e4"}  -> {"ok": true, "fen": ..., "legalMoves": ..., "status": ...}
+    {"op": "engine", "game": "...", "movetime": 0.5, "deadline": 2}
+                                                   -> the engine plays a move: {"ok": true, "move": "e7e5", ...}
+    {"op": "state", "game": "..."}                 -> fen, legal moves and status of the game
+    {"op": "close", "game": "..."}
+    {"op": "stats"}                                -> counters of the server
+
+Errors are answered with {"ok": false, "error": "..."}. status is "playing", "checkmate" or "stalemate".
+
+Games are kept in memory and dropped after --session-timeout seconds without a request.
+Engine moves are searched in a pool of --processes processes. At most --max-pending searches wait or run
+at a time, an engine request beyond that is turned away at once with "server busy" instead of queueing
+without bound. Every engine request has a deadline (seconds from its arrival, by default twice its move
+time plus a second): the search is shortened to finish before it and the request fails if it can't.
+
+    python server.py --port 8765 --processes 4
+    python loadgen.py --port 8765 --clients 16 --games 64
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import ai
+from engine import GameState
+from transposition import DEFAULT_HASH_MB
+
+DEFAULT_PORT = 8765
+DEFAULT_MOVE_TIME = 1.0
+MAX_MOVE_TIME = 30.0
+MAX_DEADLINE = 300.0
+MAX_SESSIONS = 10000
+MAX_LINE = 64 * 1024  # longest request accepted, in bytes
+SESSION_TIMEOUT = 600.0  # seconds a game is kept without a request
+SWEEP_INTERVAL = 10.0  # seconds between two looks for idle games
+DEADLINE_MARGIN = 0.05  # seconds kept between the end of a search and its deadline, for the way back
+
+
+def startProcess(hashMB, bookPath, tablebasePath):
+    """
+    Runs once in every search process
+    """
+    ai.setHashSize(hashMB)
+    ai.setOpeningBook(bookPath)
+    ai.setTablebase(tablebasePath)
+
+
+class DeadlineFlag:
+    """
+    Stop flag of a search that must end by a wall clock time, whatever its time budget says
+    """
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def is_set(self):
+        return time.time() >= self.deadline
+
+
+def searchPosition(fen, moveTime, deadline):
+    """
+    Runs in a search process: (move in coordinate notation, search depth, nodes) for the position,
+    or None if the deadline (time.time()) has passed before the search could start.
+    The search ends by the deadline even when that leaves less than moveTime
+    """
+    remaining = deadline - time.time() - DEADLINE_MARGIN
+    if remaining <= 0:
+        return None
+    gs = GameState(fen)
+    validMoves = gs.getValidMoves()
+    if not validMoves:
+        return None
+    move, stats = ai.findBestMove(gs, validMoves, None, moveTime=min(moveTime, remaining),
+                                  stopEvent=DeadlineFlag(deadline - DEADLINE_MARGIN))
+    depth = stats.iterations[-1]["depth"] if stats.iterations else 0
+    return move.getChessNotation(), depth, stats.nodes
+
+
+class RequestError(Exception):
+    """
+    A request that can't be carried out, its message is sent back to the client
+    """
+    pass
+
+
+class Session:
+    def __init__(self, fen=None):
+        self.id = uuid.uuid4().hex
+        self.gs = GameState(fen)
+        self.validMoves = self.gs.getValidMoves()
+        self.lastUsed = time.monotonic()
+        self.lock = asyncio.Lock()  # one request at a time changes the game
+
+    def getState(self):
+        status = "checkmate" if self.gs.checkmate else "stalemate" if self.gs.stalemate else "playing"
+        return {"ok": True, "game": self.id, "fen": self.gs.getFen(), "status": status,
+                "legalMoves": [move.getChessNotation() for move in self.validMoves]}
+
+    def makeMove(self, notation):
+        move = self.gs.getMoveFromNotation(notation)
+        if move is None:
+            raise RequestError("illegal move " + notation)
+        self.gs.makeMove(move)
+        self.validMoves = self.gs.getValidMoves()
+
+
+class GameServer:
+    def __init__(self, processes, maxPending, sessionTimeout=SESSION_TIMEOUT, hashMB=DEFAULT_HASH_MB,
+                 bookPath=None, tablebasePath=None):
+        """
+        Start the pool of search processes, serve starts accepting clients
+        """
+        self.pool = ProcessPoolExecutor(processes, initializer=startProcess,
+                                        initargs=(hashMB, bookPath, tablebasePath))
+        self.processes = processes
+        self.maxPending = maxPending
+        self.sessionTimeout = sessionTimeout
+        self.sessions = {}
+        self.pending = 0  # engine searches waiting for or running in the pool
+        self.stats = {"requests": 0, "searches": 0, "busy": 0, "deadlinesMissed": 0, "evicted": 0, "errors": 0}
+
+    async def serve(self, host, port):
+        # start the search processes before listening, so a forked process doesn't hold on to the socket
+        await asyncio.get_running_loop().run_in_executor(self.pool, time.time)
+        server = await asyncio.start_server(self.handleClient, host, port, limit=MAX_LINE)
+        print("serving on %s:%d with %d search processes" % (host, port, self.processes), flush=True)
+        # stop cleanly on a kill too, the search processes are shut down with the server
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        sweeper = asyncio.create_task(self.evictIdleSessions())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handleClient(self, reader, writer):
+        """
+        Answer the requests of one connection in order. A client that sends faster than it reads its answers
+        is held back by drain, so no connection can pile up unsent replies
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # longer than MAX_LINE
+                    reply = {"ok": False, "error": "request too long"}
+                    writer.write(json.dumps(reply).encode() + b"\n")
+                    break
+                if not line:
+                    break
+                reply = await self.handleRequest(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # the client went away, or the server is shutting down
+        finally:
+            writer.close()
+
+    async def handleRequest(self, line):
+        self.stats["requests"] += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("a request is a JSON object")
+            op = request.get("op")
+            if op == "new":
+                return self.newGame(request.get("fen"))
+            if op == "stats":
+                return dict(self.stats, ok=True, sessions=len(self.sessions), pending=self.pending)
+            session = self.getSession(request.get("game"))
+            async with session.lock:
+                if op == "state":
+                    return session.getState()
+                if op == "move":
+                    session.makeMove(str(request.get("move", "")))
+                    return session.getState()
+                if op == "engine":
+                    return await self.engineMove(session, request)
+                if op == "close":
+                    del self.sessions[session.id]
+                    return {"ok": True}
+            raise RequestError("unknown op %r" % op)
+        except (RequestError, ValueError, KeyError, IndexError, TypeError, AttributeError) as error:
+            self.stats["errors"] += 1
+            return {"ok": False, "error": str(error)}
+
+    def newGame(self, fen):
+        if len(self.sessions) >= MAX_SESSIONS:
+            raise RequestError("too many games")
+        session = Session(fen)
+        self.sessions[session.id] = session
+        return session.getState()
+
+    def getSession(self, gameId):
+        session = self.sessions.get(gameId)
+        if session is None:
+            raise RequestError("no game %s" % gameId)
+        session.lastUsed = time.monotonic()
+        return session
+
+    async def engineMove(self, session, request):
+        """
+        Search the game's position in the pool and play the move found
+        """
+        if not session.validMoves:
+            raise RequestError("the game is over")
+        moveTime = min(float(request.get("movetime", DEFAULT_MOVE_TIME)), MAX_MOVE_TIME)
+        timeout = min(float(request.get("deadline", 2 * moveTime + 1)), MAX_DEADLINE)
+        if not (math.isfinite(moveTime) and math.isfinite(timeout)) or moveTime <= 0 or timeout <= 0:
+            raise RequestError("movetime and deadline must be positive numbers")
+        if self.pending >= self.maxPending:
+            self.stats["busy"] += 1
+            raise RequestError("server busy")
+        loop = asyncio.get_running_loop()
+        try:
+            search = self.pool.submit(searchPosition, session.gs.getFen(), moveTime, time.time() + timeout)
+        except RuntimeError as error:  # BrokenProcessPool, or the pool is shutting down
+            raise RequestError("search pool unavailable: %s" % error)
+        # the count drops once the pool is done with the search, not when the request stops waiting for it
+        self.pending += 1
+        search.add_done_callback(lambda search: loop.call_soon_threadsafe(self.searchFinished))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(search), timeout)
+        except asyncio.TimeoutError:
+            result = None
+        except RuntimeError as error:  # BrokenProcessPool, a search process died
+            raise RequestError("search failed: %s" % error)
+        if result is None:
+            self.stats["deadlinesMissed"] += 1
+            raise RequestError("deadline exceeded")
+        self.stats["searches"] += 1
+        notation, depth, nodes = result
+        session.makeMove(notation)
+        reply = session.getState()
+        reply.update(move=notation, depth=depth, nodes=nodes)
+        return reply
+
+    def searchFinished(self):
+        self.pending -= 1
+
+    async def evictIdleSessions(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            limit = time.monotonic() - self.sessionTimeout
+            for gameId in [gameId for gameId, session in self.sessions.items()
+                           if session.lastUsed < limit and not session.lock.locked()]:
+                del self.sessions[gameId]
+                self.stats["evicted"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="search processes (default: all cores)")
+    parser.add_argument("--max-pending", type=int, help="engine requests searched or waiting at once "
+                                                        "(default: 4 per process)")
+    parser.add_argument("--session-timeout", type=float, default=SESSION_TIMEOUT, help="seconds an idle game is kept")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help="transposition table MB per process")
+    parser.add_argument("--book", help="opening book (see book.py)")
+    parser.add_argument("--tablebase", help="directory of endgame tables (see tablebase.py)")
+    args = parser.parse_args()
+
+    server = GameServer(args.processes, args.max_pending or 4 * args.processes, args.session_timeout, args.hash,
+                        args.book, args.tablebase)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
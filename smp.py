@@ -0,0 +1,88 @@
+"""
+Parallel search (Lazy SMP).
+Helper processes search the same root as the main search at the same time, all of them reading and
+filling one SharedTranspositionTable. Nothing else is shared: the helpers only make the table hold more
+and deeper results sooner, which the main search picks up as cutoffs and hash moves.
+Half of the helpers start one ply deeper and every helper shuffles the root moves differently,
+so they don't all search the same nodes in the same order.
+The move played is always the one of the main search.
+"""
+
+import random
+from multiprocessing import Event, Pipe, Process
+
+import ai
+from engine import GameState
+from transposition import SharedTranspositionTable, DEFAULT_HASH_MB
+
+
+def helperLoop(connection, table, stopEvent, index):
+    """
+    Runs in a helper process: search every position received until stopEvent is set, then report back
+    """
+    ai.transpositionTable = table
+    random.seed(index)
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            break
+        if command is None:
+            break
+        gs = GameState(command)
+        validMoves = gs.getValidMoves()
+        if validMoves and not stopEvent.is_set():
+            random.shuffle(validMoves)
+            ai.findBestMove(gs, validMoves, None, maxDepth=ai.MAX_DEPTH, stopEvent=stopEvent,
+                            startDepth=1 + index % 2)
+        connection.send(ai.nodeCount)
+    table.close()
+
+
+class LazySMP:
+    def __init__(self, threads, hashMB=DEFAULT_HASH_MB):
+        """
+        Start threads - 1 helper processes and switch ai.py of this process over to the shared table
+        """
+        self.table = SharedTranspositionTable(hashMB)
+        self.previousTable = ai.transpositionTable
+        ai.transpositionTable = self.table
+        self.stopEvent = Event()
+        self.helpers = []
+        for index in range(1, threads):
+            connection, helperConnection = Pipe()
+            process = Process(target=helperLoop, args=(helperConnection, self.table, self.stopEvent, index),
+                              daemon=True)
+            process.start()
+            helperConnection.close()
+            self.helpers.append((process, connection))
+        self.helperNodeCount = 0
+
+    def findBestMove(self, gs, validMoves, returnQueue, **options):
+        """
+        Same as ai.findBestMove, with the helpers searching alongside until it returns.
+        helperNodeCount holds the nodes the helpers searched meanwhile, the returned statistics
+        are those of the main search
+        """
+        self.stopEvent.clear()
+        fen = gs.getFen()
+        for process, connection in self.helpers:
+            connection.send(fen)
+        try:
+            return ai.findBestMove(gs, validMoves, returnQueue, **options)
+        finally:
+            self.stopEvent.set()
+            # wait for every helper, so none is still writing entries of this search into the next one
+            self.helperNodeCount = sum(connection.recv() for process, connection in self.helpers)
+
+    def close(self):
+        """
+        Stop the helpers and give ai.py its own table back
+        """
+        for process, connection in self.helpers:
+            connection.send(None)
+        for process, connection in self.helpers:
+            process.join()
+        self.helpers = []
+        ai.transpositionTable = self.previousTable
+        self.table.close()
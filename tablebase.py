@@ -0,0 +1,406 @@
+"""
+Endgame tablebases: the distance to mate of every position with a given material, e.g. KRvK.
+Tables are built offline by retrograde analysis: starting from the checkmates, positions are resolved
+one ply further from mate at a time by taking moves back, so no position is ever searched.
+Moves are generated by GameState, so the tables follow exactly the rules the engine plays by.
+
+A table is a file holding one byte per index, index = side to move * 64^n + the squares of the pieces
+in the order of the material string (white pieces first). A byte is the number of plies to mate,
+even when the side to move gets mated and odd when it mates, or DRAW or ILLEGAL.
+Tables are memory-mapped when probed, so they are read straight from the page cache.
+
+    python tablebase.py build  # the default 3-man tables
+    python tablebase.py build KQvKR --directory tables
+    python tablebase.py probe --fen "8/8/8/4k3/8/8/8/4K2R w - - 0 1"
+
+Castling and en passant are not part of a table, positions where either is possible are never probed.
+Pawns promote to a queen only, like everywhere else in the engine. A 4-man table has 64 times the indices
+of a 3-man one and takes about as much longer to build, the tables it captures into must be built first.
+
+Only the 3-man tables are built by default, and the builder stops at MAX_MEN men. The layout is a flat
+2 * 64^n array with no folding by board symmetry and no skipping of illegal placements, so a 4-man table is
+2 * 64^4 bytes (32 MB), several times what a compact index would need. The build runs in pure Python over
+every index: the forward pass of KQvKR alone took over 40 minutes and about 1.8 GB of memory. 5-man tables
+are out of reach without a compact index and a faster builder.
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import time
+
+from bitboard import KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, bishopAttacks, rookAttacks, queenAttacks, popCount
+from engine import GameState
+
+DRAW = 254
+ILLEGAL = 255
+UNKNOWN = 253  # only while building
+MAX_MEN = 4
+TABLE_DIRECTORY = "tables"
+DEFAULT_TABLES = ("KQvK", "KRvK", "KPvK")  # in build order, KPvK promotes into KQvK
+PIECE_ORDER = "KQRBNP"
+
+
+def parseMaterial(material):
+    """
+    "KQvKR" -> ['wK', 'wQ', 'bK', 'bR']
+    """
+    white, black = material.upper().split("V")
+    if white.count("K") != 1 or black.count("K") != 1 or len(white) + len(black) > MAX_MEN:
+        raise ValueError("not a material string with one king a side and at most %d men: %s" % (MAX_MEN, material))
+    pieces = []
+    for color, side in (("w", white), ("b", black)):
+        for piece in sorted(side, key=PIECE_ORDER.index):
+            pieces.append(color + ("p" if piece == "P" else piece))
+    return pieces
+
+
+def materialString(pieces):
+    """
+    Inverse of parseMaterial, for pieces in any order
+    """
+    white = "".join(sorted((piece[1].upper() for piece in pieces if piece[0] == "w"), key=PIECE_ORDER.index))
+    black = "".join(sorted((piece[1].upper() for piece in pieces if piece[0] == "b"), key=PIECE_ORDER.index))
+    return white + "v" + black
+
+
+def isInsufficientMaterial(pieces):
+    """
+    Nobody can be mated: bare kings, or kings and a single bishop or knight
+    """
+    others = [piece[1] for piece in pieces if piece[1] != "K"]
+    return len(others) == 0 or (len(others) == 1 and others[0] in "BN")
+
+
+def tableIndex(whiteToMove, squares):
+    index = 0 if whiteToMove else 1
+    for sq in squares:
+        index = index * 64 + sq
+    return index
+
+
+class Tablebase:
+    def __init__(self, directory=TABLE_DIRECTORY):
+        """
+        Map every table file found in the directory, a missing directory gives an empty tablebase
+        """
+        self.directory = directory
+        self.tables = {}
+        self.files = []
+        self.maxMen = 0
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".bin"):
+                    self.load(name[:-4])
+
+    def load(self, material):
+        tableFile = open(os.path.join(self.directory, material + ".bin"), "rb")
+        self.files.append(tableFile)
+        pieces = parseMaterial(material)
+        self.tables[material] = (pieces, mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ))
+        self.maxMen = max(self.maxMen, len(pieces))
+
+    def close(self):
+        for pieces, data in self.tables.values():
+            data.close()
+        for tableFile in self.files:
+            tableFile.close()
+        self.tables = {}
+        self.files = []
+
+    def probePieces(self, placement, whiteToMove):
+        """
+        Value for a list of (piece, square) and the side to move, or None if there is no table for it.
+        Material with the colors reversed is looked up in the table of the mirrored position
+        """
+        pieces = [piece for piece, sq in placement]
+        if isInsufficientMaterial(pieces):
+            return DRAW
+        material = materialString(pieces)
+        if material not in self.tables:
+            # swap colors and flip the board vertically
+            placement = [(("b" if piece[0] == "w" else "w") + piece[1], sq ^ 56) for piece, sq in placement]
+            whiteToMove = not whiteToMove
+            material = materialString([piece for piece, sq in placement])
+            if material not in self.tables:
+                return None
+        tablePieces, data = self.tables[material]
+        squares = []
+        used = set()
+        for tablePiece in tablePieces:
+            for i, (piece, sq) in enumerate(placement):
+                if piece == tablePiece and i not in used:
+                    used.add(i)
+                    squares.append(sq)
+                    break
+        return data[tableIndex(whiteToMove, squares)]
+
+    def probe(self, gs):
+        """
+        Value of the position for the side to move, or None if it isn't covered
+        """
+        occupied = gs.colorBitboards["w"] | gs.colorBitboards["b"]
+        if popCount(occupied) > self.maxMen:
+            return None
+        if gs.enpassantPossible:
+            # the square is set after every double push, it only matters if a pawn can take there
+            ally, enemy = ("w", "b") if gs.whiteToMove else ("b", "w")
+            enpassantSq = gs.enpassantPossible[0] * 8 + gs.enpassantPossible[1]
+            if PAWN_ATTACKS[enemy][enpassantSq] & gs.pieceBitboards[ally + "p"]:
+                return None
+        rights = gs.currentCastlingRight
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+        placement = []
+        while occupied:
+            bit = occupied & -occupied
+            occupied ^= bit
+            sq = bit.bit_length() - 1
+            placement.append((gs.board[sq >> 3][sq & 7], sq))
+        return self.probePieces(placement, gs.whiteToMove)
+
+    def getBestMove(self, gs, validMoves):
+        """
+        The move that mates fastest, draws, or holds out longest, with the value of the position,
+        or (None, None) if the position isn't covered. A checkmate or stalemate gives None with its value
+        """
+        value = self.probe(gs)
+        if value is None or value == ILLEGAL:
+            return None, None
+        if not validMoves:
+            return None, value
+        bestMove = None
+        bestKey = None
+        for move in validMoves:
+            gs.makeMove(move)
+            reply = self.probe(gs)
+            gs.undoMove()
+            if reply is None:
+                continue  # a double push the opponent can take en passant
+            key = exitKey(DRAW if reply == DRAW else reply + 1)
+            if bestKey is None or key < bestKey:
+                bestMove, bestKey = move, key
+        return bestMove, value
+
+
+def setUpPosition(gs, pieces, squares, whiteToMove):
+    """
+    Replace the pieces of a GameState used for building with the given placement
+    """
+    occupied = gs.colorBitboards["w"] | gs.colorBitboards["b"]
+    while occupied:
+        bit = occupied & -occupied
+        occupied ^= bit
+        gs.removePiece(bit.bit_length() - 1)
+    for piece, sq in zip(pieces, squares):
+        gs.putPiece(sq, piece)
+        if piece == "wK":
+            gs.whiteKingLocation = (sq >> 3, sq & 7)
+        elif piece == "bK":
+            gs.blackKingLocation = (sq >> 3, sq & 7)
+    gs.whiteToMove = whiteToMove
+
+
+def isPlaceable(pieces, squares):
+    """
+    Squares are distinct, kings don't touch and no pawn stands on the first or last rank
+    """
+    if len(set(squares)) != len(squares):
+        return False
+    kings = [sq for piece, sq in zip(pieces, squares) if piece[1] == "K"]
+    if KING_ATTACKS[kings[0]] & (1 << kings[1]):
+        return False
+    for piece, sq in zip(pieces, squares):
+        if piece[1] == "p" and (sq < 8 or sq >= 56):
+            return False
+    return True
+
+
+def unmoveSquares(piece, sq, occupied):
+    """
+    Squares the piece on sq can have come from with a move that doesn't capture or promote
+    """
+    empty = ~occupied
+    kind = piece[1]
+    if kind == "K":
+        targets = KING_ATTACKS[sq] & empty
+    elif kind == "N":
+        targets = KNIGHT_ATTACKS[sq] & empty
+    elif kind == "B":
+        targets = bishopAttacks(sq, occupied) & empty
+    elif kind == "R":
+        targets = rookAttacks(sq, occupied) & empty
+    elif kind == "Q":
+        targets = queenAttacks(sq, occupied) & empty
+    else:
+        # pawns step back towards their own side, white pawns move up the board (to lower squares)
+        back = 8 if piece[0] == "w" else -8
+        startRow = 6 if piece[0] == "w" else 1
+        targets = 0
+        if 8 <= sq + back < 56 and empty & (1 << (sq + back)):
+            targets |= 1 << (sq + back)
+            if (sq + 2 * back) >> 3 == startRow and empty & (1 << (sq + 2 * back)):
+                targets |= 1 << (sq + 2 * back)
+    squares = []
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        squares.append(bit.bit_length() - 1)
+    return squares
+
+
+def buildTable(material, directory=TABLE_DIRECTORY, log=print):
+    """
+    Compute the table for the material by retrograde analysis and write it to the directory.
+    Tables of the material left after a capture or a promotion must be built already
+    """
+    pieces = parseMaterial(material)
+    men = len(pieces)
+    size = 2 * 64 ** men
+    subtables = Tablebase(directory)
+    values = bytearray([UNKNOWN]) * size
+    remaining = bytearray(size)  # moves within this table whose outcome is still unknown
+    bestExit = bytearray([UNKNOWN]) * size  # best value for the side to move over its captures and promotions
+    buckets = [[] for _ in range(256)]  # positions to resolve, by plies to mate
+    start = time.perf_counter()
+
+    # 1. forward pass: legal positions, checkmates, stalemates and the moves that leave the table
+    gs = GameState("4k3/8/8/8/8/8/8/4K3 w - - 0 1")  # setUpPosition replaces the kings
+    for side, squares in itertools.product((True, False), itertools.product(range(64), repeat=men)):
+        index = tableIndex(side, squares)
+        if not isPlaceable(pieces, squares):
+            values[index] = ILLEGAL
+            continue
+        setUpPosition(gs, pieces, squares, side)
+        occupied = gs.colorBitboards["w"] | gs.colorBitboards["b"]
+        enemy = "b" if side else "w"
+        enemyKing = gs.pieceBitboards[enemy + "K"].bit_length() - 1
+        if gs.isSquareAttacked(enemyKing, "w" if side else "b", occupied):
+            values[index] = ILLEGAL  # the side that just moved left its king in check
+            continue
+        moves = gs.getValidMoves()
+        if not moves:
+            if gs.checkmate:
+                buckets[0].append(index)
+            else:
+                values[index] = DRAW
+            continue
+        count = 0
+        best = None
+        for move in moves:
+            if not move.isCapture and not move.isPawnPromotion:
+                count += 1
+                continue
+            placement = []
+            for piece, sq in zip(pieces, squares):
+                if sq == move.endSq:
+                    continue  # captured
+                if sq == move.startSq:
+                    piece = piece[0] + "Q" if move.isPawnPromotion else piece
+                    sq = move.endSq
+                placement.append((piece, sq))
+            reply = subtables.probePieces(placement, not side)
+            if reply is None:
+                raise ValueError("build the table for %s before %s" % (
+                    materialString([piece for piece, sq in placement]), material))
+            value = DRAW if reply == DRAW else reply + 1
+            if best is None or exitKey(value) < exitKey(best):
+                best = value
+        remaining[index] = count
+        if best is not None:
+            bestExit[index] = best
+            if best != DRAW and (best % 2 == 1 or count == 0):
+                buckets[best].append(index)  # a won exit, or a lost one with no other move
+            elif count == 0:
+                values[index] = DRAW
+    log("%s: forward pass %.0fs" % (material, time.perf_counter() - start))
+
+    # 2. backward pass: resolve positions in order of plies to mate, through the moves leading to them
+    squareOrder = [64 ** (men - 1 - i) for i in range(men)]
+    for plies in range(255):
+        bucket = buckets[plies]
+        for index in bucket:
+            if values[index] != UNKNOWN:
+                continue
+            values[index] = plies
+            side = index < size // 2
+            # the position before the move has the other side to move
+            otherSide = size // 2 if side else -(size // 2)
+            squares = [index // weight % 64 for weight in squareOrder]
+            occupied = 0
+            for sq in squares:
+                occupied |= 1 << sq
+            mover = "b" if side else "w"  # the side that made the move leading here
+            for slot, piece in enumerate(pieces):
+                if piece[0] != mover:
+                    continue
+                for fromSq in unmoveSquares(piece, squares[slot], occupied):
+                    previous = index + otherSide + (fromSq - squares[slot]) * squareOrder[slot]
+                    if values[previous] != UNKNOWN:
+                        continue
+                    if plies % 2 == 0:
+                        buckets[plies + 1].append(previous)  # the move mates or wins
+                    else:
+                        remaining[previous] -= 1
+                        if remaining[previous] == 0:
+                            exit = bestExit[previous]
+                            if exit == UNKNOWN:
+                                buckets[plies + 1].append(previous)
+                            elif exit != DRAW and exit % 2 == 0:
+                                buckets[max(plies + 1, exit)].append(previous)
+        buckets[plies] = None
+    for index in range(size):
+        if values[index] == UNKNOWN:
+            values[index] = DRAW
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, material + ".bin"), "wb") as tableFile:
+        tableFile.write(values)
+    subtables.close()
+    log("%s: done in %.0fs, longest mate %d plies" % (
+        material, time.perf_counter() - start, max(value for value in values if value < UNKNOWN)))
+
+
+def exitKey(value):
+    """
+    Sort key for values from the side to move: mates (fewest plies first), then draws, then losses
+    """
+    if value == DRAW:
+        return (1, 0)
+    if value % 2 == 1:
+        return (0, value)
+    return (2, -value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build tables")
+    build.add_argument("materials", nargs="*", default=list(DEFAULT_TABLES))
+    build.add_argument("--directory", default=TABLE_DIRECTORY)
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("--fen", required=True)
+    probe.add_argument("--directory", default=TABLE_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for material in args.materials:
+            buildTable(material, args.directory)
+    else:
+        tablebase = Tablebase(args.directory)
+        gs = GameState(args.fen)
+        move, value = tablebase.getBestMove(gs, gs.getValidMoves())
+        if value is None:
+            print("not in the tablebase")
+        elif move is None:
+            print("stalemate, draw" if value == DRAW else "checkmate, mated")
+        elif value == DRAW:
+            print("draw, %s" % move)
+        else:
+            print("%s in %d plies, %s" % ("mates" if value % 2 else "gets mated", value, move))
+        tablebase.close()
+
+
+if __name__ == "__main__":
+    main()
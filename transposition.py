@@ -0,0 +1,245 @@
+"""
+Transposition table for the negamax search.
+Positions are stored by Zobrist key in a fixed number of slots, so results for positions reached
+through different move orders (or searched on an earlier turn) can be reused.
+SharedTranspositionTable has the same interface but lives in shared memory, so several search
+processes can fill and read one table (see smp.py).
+"""
+
+import os
+import sys
+from multiprocessing import shared_memory
+
+EXACT = 0
+LOWERBOUND = 1  # the search failed high, the score is at least this
+UPPERBOUND = 2  # the search failed low, the score is at most this
+
+DEFAULT_HASH_MB = 16
+
+
+def _entrySize():
+    """
+    Approximate bytes held by one stored entry: the tuple, its key and the slot pointer.
+    Scores, depths and move ids are shared with the search and not counted.
+    """
+    return sys.getsizeof((0, 0, 0, 0, None, 0)) + sys.getsizeof(1 << 63) + 8
+
+
+ENTRY_SIZE = _entrySize()
+
+
+class TranspositionTable:
+    def __init__(self, sizeMB=DEFAULT_HASH_MB):
+        """
+        Each slot is None or a tuple (key, depth, score, flag, moveID, generation),
+        moveID being the Move.moveID of the best move or None.
+        The number of slots is the largest power of two that fits the memory budget.
+        """
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        """
+        Reallocate the table for a new memory budget, dropping all entries
+        """
+        slots = 1
+        while slots * 2 * ENTRY_SIZE <= sizeMB * 1024 * 1024:
+            slots *= 2
+        self.sizeMB = sizeMB
+        self.mask = slots - 1
+        self.clear()
+
+    def clear(self):
+        self.slots = [None] * (self.mask + 1)
+        self.generation = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0  # slot held a different position
+        self.cutoffs = 0  # counted by the search when a hit ends the node
+        self.stores = 0
+
+    def newSearch(self):
+        """
+        Called once per search, so entries left from earlier searches can be replaced first
+        """
+        self.generation += 1
+
+    def probe(self, key):
+        """
+        Returns (depth, score, flag, moveID) stored for the position, or None
+        """
+        self.probes += 1
+        entry = self.slots[key & self.mask]
+        if entry is None:
+            return None
+        if entry[0] != key:
+            self.collisions += 1
+            return None
+        self.hits += 1
+        return entry[1:5]
+
+    def store(self, key, depth, score, flag, moveID):
+        """
+        Depth-preferred replacement: an entry is only overwritten by the same position,
+        by a search at least as deep, or once it is left over from an earlier search
+        """
+        index = key & self.mask
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.slots[index] = (key, depth, score, flag, moveID, self.generation)
+            self.stores += 1
+
+    def getStats(self):
+        used = sum(1 for entry in self.slots if entry is not None)
+        return {
+            "sizeMB": self.sizeMB,
+            "slots": self.mask + 1,
+            "used": used,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hitRate": self.hits / self.probes if self.probes else 0.0,
+            "cutoffs": self.cutoffs,
+            "collisions": self.collisions,
+            "stores": self.stores
+        }
+
+
+# a shared entry is two 64-bit words: the key XOR the data, then the data word packing
+# depth (bits 0-7), flag (8-9), generation (10-17), moveID + 1 (18-30, 0 for no move) and score (31-62)
+SHARED_ENTRY_SIZE = 16
+SCORE_OFFSET = 1 << 31
+HEADER_WORDS = 2  # word 0 holds the generation of the current search
+
+
+class SharedTranspositionTable:
+    """
+    Transposition table in a multiprocessing.shared_memory block, written without locks.
+    Two processes can write the same slot at once and leave a torn entry, but the first word of an entry
+    is its key XORed with its data word, so a torn or foreign entry simply fails to match the key on probe.
+    Scores must be integers. Other processes use the table by inheriting it or getting it pickled
+    (e.g. as a Process argument), only the process that created it can resize it or free it with close
+    """
+    def __init__(self, sizeMB=DEFAULT_HASH_MB):
+        self.memory = None
+        self.ownerPid = os.getpid()
+        self.resize(sizeMB)
+
+    @property
+    def owner(self):
+        # a forked child inherits the object as it is, so ownership goes by process id
+        return os.getpid() == self.ownerPid
+
+    def resize(self, sizeMB):
+        """
+        Allocate a new shared block for a memory budget, the old one is freed
+        """
+        slots = 1
+        while slots * 2 * SHARED_ENTRY_SIZE <= sizeMB * 1024 * 1024:
+            slots *= 2
+        self.close()
+        self.memory = shared_memory.SharedMemory(create=True, size=(slots + 1) * SHARED_ENTRY_SIZE)
+        self.sizeMB = sizeMB
+        self.mask = slots - 1
+        self.attach()
+        self.clear()
+
+    def attach(self):
+        self.words = self.memory.buf.cast('Q')
+
+    def close(self):
+        """
+        Release the shared block, the creator also unlinks it
+        """
+        if self.memory is None:
+            return
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+    def __getstate__(self):
+        return {"name": self.memory.name, "sizeMB": self.sizeMB, "mask": self.mask}
+
+    def __setstate__(self, state):
+        self.memory = shared_memory.SharedMemory(name=state["name"])
+        self.ownerPid = None
+        self.sizeMB = state["sizeMB"]
+        self.mask = state["mask"]
+        self.attach()
+        self.resetStats()
+
+    def clear(self):
+        """
+        Zero every entry, all processes see the table empty
+        """
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.resetStats()
+
+    def resetStats(self):
+        # counters are per process
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.cutoffs = 0
+        self.stores = 0
+
+    @property
+    def generation(self):
+        return self.words[0]
+
+    def newSearch(self):
+        """
+        Only the creating process starts a new search, helpers keep reading the shared generation
+        """
+        if self.owner:
+            self.words[0] = (self.words[0] + 1) & 0xFF
+
+    def probe(self, key):
+        """
+        Returns (depth, score, flag, moveID) stored for the position, or None
+        """
+        self.probes += 1
+        index = HEADER_WORDS + ((key & self.mask) << 1)
+        data = self.words[index + 1]
+        check = self.words[index]
+        if data == 0 and check == 0:
+            return None
+        if check ^ data != key:
+            self.collisions += 1
+            return None
+        self.hits += 1
+        moveID = (data >> 18) & 0x1FFF
+        return (data & 0xFF, (data >> 31) - SCORE_OFFSET, (data >> 8) & 3, moveID - 1 if moveID else None)
+
+    def store(self, key, depth, score, flag, moveID):
+        """
+        Same depth-preferred replacement as TranspositionTable
+        """
+        index = HEADER_WORDS + ((key & self.mask) << 1)
+        words = self.words
+        generation = words[0]
+        data = words[index + 1]
+        if data == 0 or words[index] ^ data == key or (data >> 10) & 0xFF != generation or depth >= data & 0xFF:
+            data = (depth | flag << 8 | generation << 10 | (moveID + 1 if moveID is not None else 0) << 18
+                    | (score + SCORE_OFFSET) << 31)
+            words[index] = key ^ data
+            words[index + 1] = data
+            self.stores += 1
+
+    def getStats(self):
+        words = self.words
+        used = sum(1 for index in range(HEADER_WORDS + 1, HEADER_WORDS + 2 * (self.mask + 1), 2) if words[index])
+        return {
+            "sizeMB": self.sizeMB,
+            "slots": self.mask + 1,
+            "used": used,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hitRate": self.hits / self.probes if self.probes else 0.0,
+            "cutoffs": self.cutoffs,
+            "collisions": self.collisions,
+            "stores": self.stores
+        }
@@ -0,0 +1,295 @@
+"""
+UCI (Universal Chess Interface) front-end, so the engine can be run by tournament managers and GUIs:
+
+    cutechess-cli -engine cmd="python uci.py" -engine cmd=stockfish -each tc=40/60 -games 10
+
+Reads commands on standard input and answers on standard output. A search runs on a background thread,
+so stop, isready and quit are answered while it is searching, and every completed depth is reported
+with an info line. Supported commands: uci, debug, isready, setoption, ucinewgame, position, go, stop,
+ponderhit and quit. go understands depth, movetime, wtime, btime, winc, binc, movestogo, infinite and ponder.
+go ponder searches until stop or ponderhit, after ponderhit it goes on until the time the same go without
+ponder would have had, counted from go, is used up.
+Pawns always promote to a queen, so an underpromotion sent in a position command is played as a queen.
+"""
+
+import sys
+import threading
+import time
+
+import ai
+from engine import GameState, START_FEN
+from smp import LazySMP
+from transposition import DEFAULT_HASH_MB
+
+ENGINE_NAME = "python-chess-engine"
+ENGINE_AUTHOR = "vonderklaas"
+MAX_THREADS = 64
+MAX_HASH_MB = 4096
+# name: (UCI option declaration)
+OPTIONS = {
+    "Hash": "type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB),
+    "Threads": "type spin default 1 min 1 max %d" % MAX_THREADS,
+    "BookFile": "type string default <empty>",
+    "TablebasePath": "type string default <empty>",
+    "Ponder": "type check default false",  # tells the GUI it may send go ponder, nothing to set
+}
+
+
+def formatScore(score, pv):
+    """
+    UCI score of a search score: centipawns, or moves to mate. The search doesn't keep the distance
+    of a mate it finds, the length of the principal variation stands in for it
+    """
+    if abs(score) >= ai.CHECKMATE:
+        moves = (len(pv) + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    if abs(score) > ai.MATE_BOUND:
+        # tablebase scores count down from TABLEBASE_WIN by the plies to mate
+        moves = (ai.TABLEBASE_WIN - abs(score) + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    return "cp %d" % (score * 10)  # scores are in tenths of a pawn
+
+
+class PonderFlag:
+    """
+    Stop flag of go ponder: set by stop, or once ponderhit has come (hitTime is set), when budget seconds
+    have passed since go. A search that pondered longer than that stops at the hit
+    """
+    def __init__(self, stopEvent, budget):
+        self.stopEvent = stopEvent
+        self.deadline = time.time() + budget if budget is not None else None
+        self.hitTime = None
+
+    def is_set(self):
+        if self.stopEvent.is_set():
+            return True
+        return self.hitTime is not None and self.deadline is not None and time.time() >= max(self.hitTime,
+                                                                                              self.deadline)
+
+
+class UCIEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = GameState()
+        self.hashMB = DEFAULT_HASH_MB
+        self.threads = 1
+        self.smp = None
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+        self.answerEvent = threading.Event()  # bestmove may be sent, held back under go infinite and go ponder
+        self.ponderFlag = None
+
+    def send(self, line):
+        """
+        Write one line, the search thread and the command loop both write
+        """
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def formatPV(self, pv):
+        """
+        UCI notation of a principal variation, played out on the position being searched
+        """
+        notations = []
+        for notation in pv:
+            move = self.gs.getMoveFromNotation(notation)
+            if move is None:
+                break
+            notations.append(notation + "q" if move.isPawnPromotion else notation)
+            self.gs.makeMove(move)
+        for _ in notations:
+            self.gs.undoMove()
+        return notations
+
+    def reportIteration(self, iteration):
+        """
+        Called by the search thread after every completed depth
+        """
+        pv = self.formatPV(iteration["pv"])
+        milliseconds = int(iteration["time"] * 1000)
+        nps = int(iteration["nodes"] / iteration["time"]) if iteration["time"] > 0 else 0
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s"
+                  % (iteration["depth"], formatScore(iteration["score"], pv), iteration["nodes"], nps,
+                     milliseconds, " ".join(pv)))
+
+    def handle(self, line):
+        """
+        Carry out one command, returns False on quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            for name, declaration in OPTIONS.items():
+                self.send("option name %s %s" % (name, declaration))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.waitForSearch()
+            self.setOption(arguments)
+        elif command == "ucinewgame":
+            self.waitForSearch()
+            ai.transpositionTable.clear()
+            ai.historyTable[:] = [0] * len(ai.historyTable)
+        elif command == "position":
+            self.waitForSearch()
+            self.setPosition(arguments)
+        elif command == "go":
+            self.waitForSearch()
+            self.go(arguments)
+        elif command == "stop":
+            self.stopEvent.set()
+            self.answerEvent.set()
+        elif command == "ponderhit":
+            if self.ponderFlag is not None:
+                self.ponderFlag.hitTime = time.time()
+                self.ponderFlag = None
+                self.answerEvent.set()
+        elif command == "quit":
+            self.waitForSearch()
+            if self.smp is not None:
+                self.smp.close()
+            return False
+        # debug and unknown commands are ignored, as UCI asks
+        return True
+
+    def setOption(self, arguments):
+        """
+        setoption name <name> [value <value>], names may contain spaces
+        """
+        if "name" not in arguments:
+            return
+        if "value" in arguments:
+            name = " ".join(arguments[arguments.index("name") + 1:arguments.index("value")])
+            value = " ".join(arguments[arguments.index("value") + 1:])
+        else:
+            name, value = " ".join(arguments[arguments.index("name") + 1:]), ""
+        if value == "<empty>":
+            value = ""
+        if name == "Hash":
+            self.hashMB = max(1, min(int(value), MAX_HASH_MB))
+            if self.smp is None:
+                ai.setHashSize(self.hashMB)
+            else:
+                self.startSMP()
+        elif name == "Threads":
+            self.threads = max(1, min(int(value), MAX_THREADS))
+            self.startSMP()
+        elif name == "BookFile":
+            ai.setOpeningBook(value or None)
+        elif name == "TablebasePath":
+            ai.setTablebase(value or None)
+        else:
+            self.send("info string unknown option " + name)
+
+    def startSMP(self):
+        """
+        Replace the helper processes after a change of Threads or Hash
+        """
+        if self.smp is not None:
+            self.smp.close()
+            self.smp = None
+        if self.threads > 1:
+            self.smp = LazySMP(self.threads, self.hashMB)
+        else:
+            ai.setHashSize(self.hashMB)
+
+    def setPosition(self, arguments):
+        """
+        position [startpos | fen <fen>] [moves <move> ...]
+        """
+        movesIndex = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments and arguments[0] == "fen":
+            try:
+                self.gs = GameState(" ".join(arguments[1:movesIndex]))
+            except ValueError as error:
+                self.send("info string " + str(error))  # the position stays as it was
+                return
+        else:
+            self.gs = GameState(START_FEN)
+        for notation in arguments[movesIndex + 1:]:
+            move = self.gs.getMoveFromNotation(notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                break
+            self.gs.makeMove(move)
+
+    def go(self, arguments):
+        values = {}
+        for name in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo"):
+            if name in arguments:
+                values[name] = int(arguments[arguments.index(name) + 1])
+        infinite = "infinite" in arguments
+        ponder = "ponder" in arguments and not infinite
+
+        options = {"movesToGo": values.get("movestogo")}
+        clock, increment = ("wtime", "winc") if self.gs.whiteToMove else ("btime", "binc")
+        if "movetime" in values:
+            options["moveTime"] = values["movetime"] / 1000
+        elif clock in values and not infinite:
+            options["clockTime"] = values[clock] / 1000
+            options["increment"] = values.get(increment, 0) / 1000
+        if "depth" in values:
+            options["maxDepth"] = max(1, min(values["depth"], ai.MAX_DEPTH))
+        elif infinite or ponder or ("moveTime" not in options and "clockTime" not in options):
+            options["maxDepth"] = ai.MAX_DEPTH  # until stop, or under go ponder until the time after ponderhit
+
+        self.stopEvent = threading.Event()
+        self.answerEvent = threading.Event()
+        stopFlag = self.stopEvent
+        if ponder:
+            # the ponder flag keeps the time, the search itself runs without a budget
+            budget = ai.allocateTime(options.pop("moveTime", None), options.pop("clockTime", None),
+                                     options.pop("increment", 0.0), options["movesToGo"])
+            self.ponderFlag = stopFlag = PonderFlag(self.stopEvent, budget)
+        else:
+            self.ponderFlag = None
+            if not infinite:
+                self.answerEvent.set()
+        self.searchThread = threading.Thread(target=self.search, args=(options, stopFlag), daemon=True)
+        self.searchThread.start()
+
+    def search(self, options, stopFlag):
+        """
+        Runs on the search thread, ends with the bestmove line
+        """
+        gs = self.gs
+        validMoves = gs.getValidMoves()
+        bestMove = None
+        if validMoves:
+            findBestMove = self.smp.findBestMove if self.smp is not None else ai.findBestMove
+            bestMove, stats = findBestMove(gs, validMoves, None, stopEvent=stopFlag,
+                                           reportIteration=self.reportIteration, **options)
+        # under go infinite bestmove may only be sent once the GUI says stop, under go ponder once it says
+        # stop or ponderhit
+        self.answerEvent.wait()
+        self.send("bestmove " + (self.formatPV([bestMove.getChessNotation()])[0] if bestMove is not None else "0000"))
+
+    def waitForSearch(self):
+        """
+        A command that changes the engine state stops a running search first
+        """
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.answerEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        engine.waitForSearch()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Long-lived search process for the GUI.
+The worker keeps its own GameState in step with the game through small commands sent over a pipe
+(a move in coordinate notation, an undo or a FEN), so nothing is pickled per move and the transposition
+table, killer moves and history table of ai.py stay warm from one move to the next.
+A search is stopped cooperatively: the search polls a shared stop counter instead of being terminated.
+While the opponent thinks the worker can ponder: search the position after the reply it expects, so
+the answer is ready or well under way when that reply is played, and the table is warm when it isn't.
+"""
+
+import time
+from multiprocessing import Pipe, Process, Value
+
+import ai
+from engine import GameState
+from smp import LazySMP
+
+# commands sent to the worker process, each is a tuple starting with one of these
+POSITION = "position"  # (POSITION, fen or None for the initial position)
+MOVE = "move"  # (MOVE, notation)
+UNDO = "undo"  # (UNDO,)
+GO = "go"  # (GO, searchId, keyword arguments of findBestMove)
+PONDER = "ponder"  # (PONDER, searchId, notation of the expected reply or None, moveTime)
+QUIT = "quit"  # (QUIT,)
+# answer of the worker to a command it can't carry out, the command is skipped and the worker goes on
+ERROR = "error"  # (ERROR, message)
+
+
+class StopFlag:
+    """
+    Tells one search whether it has been stopped, with the is_set() interface findBestMove polls.
+    Every search with an id up to the shared value is stopped, so a stop can never be lost or
+    hit a later search, whatever the order in which the two processes get to it
+    """
+    def __init__(self, stoppedId, searchId):
+        self.stoppedId = stoppedId
+        self.searchId = searchId
+
+    def is_set(self):
+        return self.stoppedId.value >= self.searchId
+
+
+class PonderFlag(StopFlag):
+    """
+    Stop flag of a search on the opponent's time. It runs until stopped, or once the expected reply
+    has been played (ponderHitTime is set), until it has searched moveTime in all. A search that pondered
+    longer than that is stopped at the hit and answers right away
+    """
+    def __init__(self, stoppedId, searchId, ponderHitTime, moveTime):
+        StopFlag.__init__(self, stoppedId, searchId)
+        self.ponderHitTime = ponderHitTime
+        self.deadline = time.time() + moveTime
+
+    def is_set(self):
+        if StopFlag.is_set(self):
+            return True
+        # wall clock time, the hit is timed in the other process
+        hitTime = self.ponderHitTime.value
+        return hitTime > 0 and time.time() >= max(hitTime, self.deadline)
+
+
+def workerLoop(connection, stoppedId, ponderHitTime, threads, bookPath, tablebasePath):
+    """
+    Runs in the worker process: apply commands in order, answer every GO and PONDER with
+    (searchId, notation, stats) where notation is None if there is no move to play and stats is
+    the ai.SearchStats of the search. A FEN or a move that isn't valid here is answered with
+    (ERROR, message) and leaves the board as it was. With more than one thread the searches run under Lazy SMP
+    """
+    ai.setOpeningBook(bookPath)
+    ai.setTablebase(tablebasePath)
+    smp = LazySMP(threads) if threads > 1 else None
+    findBestMove = smp.findBestMove if smp is not None else ai.findBestMove
+    gs = GameState()
+    skipUndo = False  # the expected reply of a ponder search couldn't be played, so its UNDO has nothing to undo
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            break
+        if command[0] == UNDO and skipUndo:
+            skipUndo = False
+            continue
+        skipUndo = False
+        if command[0] == POSITION:
+            try:
+                gs = GameState(command[1])
+            except ValueError as error:
+                connection.send((ERROR, str(error)))
+        elif command[0] == MOVE:
+            move = gs.getMoveFromNotation(command[1])
+            if move is None:
+                connection.send((ERROR, "illegal move sent to the search worker: " + command[1]))
+            else:
+                gs.makeMove(move)
+        elif command[0] == UNDO:
+            gs.undoMove()
+        elif command[0] == GO:
+            searchId, options = command[1], command[2]
+            validMoves = gs.getValidMoves()
+            move, stats = None, ai.SearchStats()
+            if validMoves:
+                move, stats = findBestMove(gs, validMoves, None, stopEvent=StopFlag(stoppedId, searchId), **options)
+            connection.send((searchId, move.getChessNotation() if move is not None else None, stats))
+        elif command[0] == PONDER:
+            searchId, notation, moveTime = command[1], command[2], command[3]
+            if notation is not None:
+                move = gs.getMoveFromNotation(notation)
+                if move is None:
+                    connection.send((ERROR, "illegal ponder move sent to the search worker: " + notation))
+                    connection.send((searchId, None, ai.SearchStats()))
+                    skipUndo = True
+                    continue
+                gs.makeMove(move)
+            validMoves = gs.getValidMoves()
+            move, stats = None, ai.SearchStats()
+            if validMoves:
+                stopFlag = PonderFlag(stoppedId, searchId, ponderHitTime, moveTime)
+                move, stats = findBestMove(gs, validMoves, None, maxDepth=ai.MAX_DEPTH, stopEvent=stopFlag)
+            connection.send((searchId, move.getChessNotation() if move is not None else None, stats))
+        elif command[0] == QUIT:
+            break
+    if smp is not None:
+        smp.close()
+    connection.close()
+
+
+class SearchWorker:
+    def __init__(self, threads=1, bookPath=None, tablebasePath=None):
+        """
+        Start the worker process, it begins at the initial position.
+        threads is the number of processes searching each move (see smp.py),
+        bookPath an opening book to play from (see book.py) and tablebasePath a directory of endgame tables
+        (see tablebase.py)
+        """
+        self.connection, workerConnection = Pipe()
+        self.stoppedId = Value('i', 0)
+        self.ponderHitTime = Value('d', 0.0)
+        self.searchId = 0
+        self.pondering = False
+        self.ponderMove = None  # notation of the reply the running ponder search expects
+        # a daemon process may not start the helpers, without daemon it stops when the pipe closes
+        self.process = Process(target=workerLoop,
+                               args=(workerConnection, self.stoppedId, self.ponderHitTime, threads, bookPath,
+                                     tablebasePath),
+                               daemon=threads == 1)
+        self.process.start()
+        workerConnection.close()
+
+    def setPosition(self, fen=None):
+        self.cancelPonder()
+        self.connection.send((POSITION, fen))
+
+    def makeMove(self, move):
+        """
+        Play a move on the worker's board. Returns True if it is the reply a ponder search expected:
+        that search then goes on as the search of this move and getResult gives its answer
+        """
+        notation = move.getChessNotation()
+        if self.pondering and notation == self.ponderMove:
+            self.pondering = False
+            self.ponderHitTime.value = time.time()
+            return True
+        self.cancelPonder()
+        self.connection.send((MOVE, notation))
+        return False
+
+    def undoMove(self):
+        self.cancelPonder()
+        self.connection.send((UNDO,))
+
+    def go(self, **options):
+        """
+        Start searching the current position, options are passed to ai.findBestMove (moveTime, clockTime,
+        increment, maxDepth). Returns the id of the search, a search started earlier is superseded
+        """
+        self.stop()
+        self.searchId += 1
+        self.connection.send((GO, self.searchId, options))
+        return self.searchId
+
+    def ponder(self, notation, moveTime):
+        """
+        Search while the opponent thinks. notation is the reply expected (e.g. the second move of
+        the principal variation), searched after playing it on the worker's board. None searches the
+        current position instead, which fills the table for every reply.
+        moveTime is what the search may take in all if the expected reply is played
+        """
+        self.stop()
+        self.searchId += 1
+        self.ponderHitTime.value = 0.0
+        self.pondering = True
+        self.ponderMove = notation
+        self.connection.send((PONDER, self.searchId, notation, moveTime))
+
+    def cancelPonder(self):
+        """
+        Stop pondering and take back the expected reply, what the search stored in the table is kept
+        """
+        if self.pondering:
+            self.pondering = False
+            self.stop()
+            if self.ponderMove is not None:
+                self.connection.send((UNDO,))
+
+    def stop(self):
+        """
+        Ask the running search, if any, to finish early. It still answers with the best move it has,
+        which getResult drops once another search has been started
+        """
+        self.stoppedId.value = self.searchId
+
+    def getResult(self):
+        """
+        Without blocking: (True, notation, stats) once the latest search is done, notation being None if
+        there was no move to play, otherwise (False, None, None). Answers to superseded searches are thrown away,
+        errors of the worker are printed
+        """
+        while self.connection.poll():
+            reply = self.connection.recv()
+            if reply[0] == ERROR:
+                print("search worker:", reply[1])
+                continue
+            searchId, notation, stats = reply
+            if searchId == self.searchId:
+                return True, notation, stats
+        return False, None, None
+
+    def quit(self):
+        self.stop()
+        self.connection.send((QUIT,))
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,39 @@
+"""
+Zobrist keys used to hash chess positions.
+A position's key is the XOR of one random 64-bit number per (piece, square), one for the side to move,
+one for the castling rights and one for the en passant file, so GameState can update it incrementally.
+"""
+
+import random
+
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+
+# fixed seed: keys must be identical in every process that shares hashes (workers, books, tables)
+_random = random.Random(0x5EED)
+
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)] for piece in PIECES}
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)]
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+def castlingIndex(castleRights):
+    return castleRights.wks | castleRights.wqs << 1 | castleRights.bks << 2 | castleRights.bqs << 3
+
+
+def computeKey(gs):
+    """
+    Hash a GameState from scratch
+    """
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][r * 8 + c]
+    if not gs.whiteToMove:
+        key ^= BLACK_TO_MOVE_KEY
+    key ^= CASTLING_KEYS[castlingIndex(gs.currentCastlingRight)]
+    if gs.enpassantPossible:
+        key ^= ENPASSANT_KEYS[gs.enpassantPossible[1]]
+    return key